@@ -0,0 +1,706 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Benchmarks of the PostiATS utilities.
+
+Each benchmark compares the time and memory costs of alternative formats or
+implementations, on real input files given on the command line.
+
+"""
+
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import cache
+from . import declarations
+from . import filter as message_filter
+from . import filtering
+from . import environment
+from . import jsonized
+from . import lexemes
+from . import lexemes_compiled
+from . import lexemes_incremental
+from . import locations
+from . import packing
+from . import tags as t
+
+# Constants
+# ============================================================================
+
+REPEAT = 5  # Best of REPEAT runs is retained.
+
+EDITS = 100  # Number of edits of each file, by the relexing benchmark.
+
+STARTUP_BUDGET = 20  # Default budget of import time of a command, in ms.
+
+# Module of each command, as imported by its script.
+COMMAND_MODULES = [
+    ("pats-filter", "filtering"),
+    ("pats-jsonized", "cache"),
+    ("pats-lex", "lexing"),
+    ("pats-ls", "listing"),
+    ("pats-server", "server"),
+    ("pats-whatis", "whatis"),
+    ("pats-which", "environment"),
+    ("forwarding", "client")]
+
+# Pieces of the random texts of `check_lexer`, as ATS lexemes and their
+# prefixes and suffixes, and single characters.
+LEXER_PIECES = list(
+    " \n\t\"'\\()[]{}<>=-+*/%$#@!?.,;:~&|^`_0123456789abcxXeEpPlLuUfF") + [
+        "(*", "*)", "/*", "*/", "//", "////", "%{", "%{#", "%}", "\n%}",
+        "t@ype", "vt@ype", "viewt@ype", "=<", "=<>", "-<", "->", ":<", "0x",
+        "0x1p3", "1.5e+3", "'\\n'", "'a'", "\"abc\"", "\\x", "\\0x", "fun",
+        "val", "staload", "#include", "$showtype", "#[", "@[", "$tup", "l@",
+        "abc!", "abc<", "abc[", ".1", " .5", "..", "...", "\\012", "?>"]
+
+LEXER_TEXTS = 5000  # Number of random texts checked by `check_lexer`.
+
+# Names loaded by `staload`, `dynload` or `#include`, in ATS sources.
+LOADED_NAME = re.compile(
+    r'(?:staload|dynload|#include)\s+(?:\w+\s*=\s*)?"([^"]+)"')
+
+HELP = """\
+Usage: %s [-h|--help|cache-format file|filter file...|lexer [path...]|
+    relex [path...]|tokens [path...]|input [path...]|which [path...]|
+    locations [path...]|startup [budget]]
+
+ * No argument: check `lexemes_compiled.raw` gives the same lexemes as
+   `lexemes.raw`, on random texts and on the ATS files in `PATSHOME`, if
+   defined. Exit with status 1 if not.
+ * -h/--help: display this help.
+ * cache-format file: load time and memory of the JSON data of file, from
+   the JSON text cache format and from the packed cache format.
+ * filter file...: time of folding the expressions in the lines of the
+   files, which are `patsopt` error logs, by `pats-filter` and by trying a
+   parse at each character as it used to.
+ * lexer [path...]: check `lexemes_compiled.raw` gives the same lexemes as
+   `lexemes.raw`, and compare their throughput, on the ATS files in paths,
+   which are files or directories, or else in `PATSHOME`.
+ * relex [path...]: check `lexemes_incremental.relex` gives the same
+   lexemes as lexing the whole text again, after random edits, and compare
+   their time, on the same files as `lexer`.
+ * tokens [path...]: time and memory of holding the lexemes of the same
+   files as `lexer`, as lists of tuples and as `lexemes.TokenTable`.
+ * input [path...]: time and memory of the token tables of the same files
+   as `lexer`, lexed by `lexemes.raw` from decoded text and from files
+   mapped in memory. The mapped pages are not counted as allocated memory.
+ * which [path...]: throughput of `environment.which`, with and without its
+   cache and with the directory index, resolving the names loaded by the
+   same files as `lexer`.
+ * locations [path...]: check `locations.parse` gives the same locations as
+   it used to by searching tags, and compare their throughput, with and
+   without memoization, on the locations in the JSON data of the same files
+   as `lexer`.
+ * startup [budget]: import time of the module of each command, in a new
+   process, as by `python -X importtime`. Exit with status 1 if one is more
+   than budget milliseconds, defaulting to %i.
+
+"""
+
+
+# Helpers
+# ============================================================================
+
+def perror(message):
+    """ Shorthand to print to `stderr`. """
+    print(message, file=sys.stderr)
+
+
+def error(message):
+    """ `perror` and `sys.exit(1)`. """
+    perror(message)
+    sys.exit(1)
+
+
+# Measures
+# ============================================================================
+
+def best_time(function, repeat=REPEAT):
+    """ Best time in seconds, of `repeat` invocations of `function`. """
+    result = None
+    for _i in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        if result is None or duration < result:
+            result = duration
+    return result
+
+
+def peak_memory(function):
+    """ Peak memory in bytes, allocated during an invocation of `function`.
+    """
+    tracemalloc.start()
+    function()
+    (_current, result) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result
+
+
+def report(label, function):
+    """ Print time and memory of `function`, with `label`. """
+    seconds = best_time(function)
+    memory = peak_memory(function)
+    print("%-32s %10.2f ms %12.1f KiB" % (
+        label,
+        seconds * 1000,
+        memory / 1024))
+
+
+# Cache format
+# ============================================================================
+
+def load_text(file_name):
+    """ JSON object from JSON text in `file_name`. """
+    source = open(file_name, "r")
+    result = json.load(source)
+    source.close()
+    return result
+
+
+def benchmark_cache_format(file_name):
+    """ Compare loading JSON text with loading packed sections. """
+    json_object = jsonized.get_json(file_name)
+    if json_object is None:
+        error("Failed to evaluate %s" % file_name)
+    with tempfile.TemporaryDirectory() as directory:
+        base_name = os.path.join(directory, "data")
+        text_file_name = base_name + jsonized.JSON_EXT
+        packed_file_name = base_name + jsonized.PACKED_EXT
+        text = json.dumps(json_object)
+        jsonized.write_cache_file(text_file_name, text)
+        packed = packing.packed(json_object)
+        jsonized.write_cache_file(packed_file_name, packed)
+        print("JSON text size: %i bytes" % os.path.getsize(text_file_name))
+        print("Packed size: %i bytes" % os.path.getsize(packed_file_name))
+        report(
+            "JSON text, all sections",
+            lambda: load_text(text_file_name))
+        report(
+            "Packed, all sections",
+            lambda: packing.unpacked(packed_file_name))
+        report(
+            "Packed, sections of pats-ls",
+            lambda: packing.unpacked(packed_file_name, declarations.SECTIONS))
+        report(
+            "Packed, sections of pats-whatis",
+            lambda: packing.unpacked(packed_file_name, [t.D2ECLIST]))
+
+
+# Filter
+# ============================================================================
+
+def folded_per_character(text):
+    """ Like `filtering.folded`, trying a parse at each character of `text`.
+
+    The parses are not memoized, as it was before `filtering.folded`. An
+    IndexError is raised at an unterminated expression.
+
+    """
+    pieces = []
+    trees = []
+    string = message_filter.String(text)
+    while string.has_item():
+        string.push()
+        string.memo.clear()
+        tree = message_filter.parse_node(string)
+        if filtering.is_root_node(tree):
+            string.unpush()
+            if not string.has_item() or string.item() != "]":
+                pieces.append("[%i]" % (len(trees) + 1))
+            else:
+                pieces.append("%i" % (len(trees) + 1))
+            trees.append(tree)
+        else:
+            string.pop()
+            pieces.append(string.item())
+            string.consume()
+    return ("".join(pieces), trees)
+
+
+def fold_all(lines, method):
+    """ Apply `method` to each of `lines`, return the results. """
+    result = []
+    for line in lines:
+        try:
+            result.append(method(line))
+        except IndexError:
+            result.append(None)
+    return result
+
+
+def folded_joined(text):
+    """ `filtering.folded` with its pieces joined, as `folded_per_character`.
+    """
+    (pieces, trees, _sources) = filtering.folded(text)
+    result = ("".join(pieces), trees)
+    return result
+
+
+def benchmark_filter(file_names):
+    """ Compare `filtering.folded` with `folded_per_character`. """
+    lines = []
+    for file_name in file_names:
+        source = open(file_name, "r")
+        lines.extend(line.strip() for line in source)
+        source.close()
+    size = sum(len(line) for line in lines)
+    print("%i lines, %i characters" % (len(lines), size))
+    expected = fold_all(lines, folded_per_character)
+    actual = fold_all(lines, folded_joined)
+    for (line, expected_result, actual_result) in zip(
+            lines, expected, actual):
+        if expected_result is not None and expected_result != actual_result:
+            error("Different result for: %s" % line)
+    old_time = best_time(lambda: fold_all(lines, folded_per_character), 1)
+    new_time = best_time(lambda: fold_all(lines, folded_joined))
+    print("%-32s %10.2f ms" % ("Parse at each character", old_time * 1000))
+    print("%-32s %10.2f ms" % ("Parse at root node starts", new_time * 1000))
+    print("Speedup: %.1f" % (old_time / new_time))
+
+
+# Lexer
+# ============================================================================
+
+def lexer_files(paths):
+    """ ATS files of `paths`, or else of `PATSHOME`. """
+    if not paths:
+        paths = [environment.CURRENT.patshome]
+    result = []
+    for path in paths:
+        if path is not None and os.path.isdir(path):
+            result.extend(cache.files_from_root(path, jsonized.is_ats_file))
+        elif path is not None:
+            result.append(path)
+    return result
+
+
+def lexed(raw, text):
+    """ List of the `raw` lexemes of `text`. """
+    result = list(raw(lexemes.Input(text)))
+    return result
+
+
+def check_lexer(paths):
+    """ Check `lexemes_compiled.raw` gives the same lexemes as `lexemes.raw`.
+
+    The texts checked are those of the files of `paths`, as by `lexer_files`,
+    which are returned, and if `paths` is None, reproducible random texts of
+    `LEXER_PIECES`, and the files of `PATSHOME`, if defined. Exit with an
+    error at the first difference.
+
+    """
+    if paths is None:
+        generator = random.Random(0)
+        for _i in range(LEXER_TEXTS):
+            text = "".join(
+                generator.choice(LEXER_PIECES)
+                for _j in range(generator.randrange(32)))
+            if lexed(lexemes.raw, text) != lexed(lexemes_compiled.raw, text):
+                error("Different lexemes for: %r" % text)
+        print("%i random texts, same lexemes" % LEXER_TEXTS)
+        paths = []
+        if environment.CURRENT.patshome is None:
+            return []
+    result = []
+    for file_name in lexer_files(paths):
+        text = lexemes.file_input(file_name).source
+        if lexed(lexemes.raw, text) != lexed(lexemes_compiled.raw, text):
+            error("Different lexemes for: %s" % file_name)
+        result.append(text)
+    size = sum(len(text) for text in result)
+    print("%i files, %i bytes, same lexemes" % (len(result), size))
+    return result
+
+
+def benchmark_lexer(paths):
+    """ Compare `lexemes_compiled.raw` with `lexemes.raw`. """
+    texts = check_lexer(paths)
+    size = sum(len(text) for text in texts)
+    for (label, raw) in [
+            ("lexemes.raw", lexemes.raw),
+            ("lexemes_compiled.raw", lexemes_compiled.raw)]:
+        seconds = best_time(
+            lambda raw=raw: [lexed(raw, text) for text in texts],
+            1)
+        print("%-32s %10.2f MB/s" % (label, size / seconds / 1000000))
+
+
+# Relexing
+# ============================================================================
+
+def random_edits(text, count):
+    """ `count` random edits of one character of `text`, reproducible. """
+    generator = random.Random(len(text))
+    result = []
+    for _i in range(count):
+        offset = generator.randrange(len(text) + 1)
+        if offset < len(text) and generator.random() < 0.5:
+            edit = (offset, 1, "")
+        else:
+            edit = (offset, 0, generator.choice(" \n\"(*)x1=<>"))
+        result.append(edit)
+    return result
+
+
+def relex_all(text, edits):
+    """ Do `edits` in turn, relexing `text` incrementally. """
+    lexemes_list = lexed(lexemes_compiled.raw, text)
+    for (offset, deleted, inserted) in edits:
+        relexing = lexemes_incremental.relex(
+            text, lexemes_list, offset, deleted, inserted)
+        text = relexing.text
+        lexemes_list = relexing.lexemes
+    return lexemes_list
+
+
+def lex_all(text, edits):
+    """ Do `edits` in turn, lexing the whole of `text` again. """
+    lexemes_list = lexed(lexemes_compiled.raw, text)
+    for (offset, deleted, inserted) in edits:
+        text = text[:offset] + inserted + text[offset + deleted:]
+        lexemes_list = lexed(lexemes_compiled.raw, text)
+    return lexemes_list
+
+
+def benchmark_relex(paths):
+    """ Compare `lexemes_incremental.relex` with lexing again. """
+    cases = []
+    for file_name in lexer_files(paths):
+        text = lexemes.file_input(file_name).source
+        edits = random_edits(text, EDITS)
+        if relex_all(text, edits) != lex_all(text, edits):
+            error("Different lexemes for: %s" % file_name)
+        cases.append((text, edits))
+    print("%i files, %i edits each, same lexemes" % (len(cases), EDITS))
+    old_time = best_time(
+        lambda: [lex_all(text, edits) for (text, edits) in cases], 1)
+    new_time = best_time(
+        lambda: [relex_all(text, edits) for (text, edits) in cases], 1)
+    print("%-32s %10.2f ms" % ("Lexing again", old_time * 1000))
+    print("%-32s %10.2f ms" % ("Relexing", new_time * 1000))
+    print("Speedup: %.1f" % (old_time / new_time))
+
+
+# Tokens
+# ============================================================================
+
+def benchmark_tokens(paths):
+    """ Compare lists of lexemes with `lexemes.TokenTable`. """
+    texts = []
+    for file_name in lexer_files(paths):
+        text = lexemes.file_input(file_name).source
+        table = lexemes.token_table(lexemes.Input(text))
+        if list(table) != lexed(lexemes.raw, text):
+            error("Different lexemes for: %s" % file_name)
+        texts.append(text)
+    size = sum(len(text) for text in texts)
+    print("%i files, %i bytes, same lexemes" % (len(texts), size))
+    report(
+        "Lists of tuples",
+        lambda: [lexed(lexemes_compiled.raw, text) for text in texts])
+    report(
+        "Token tables",
+        lambda: [
+            lexemes.token_table(lexemes.Input(text), lexemes_compiled.raw)
+            for text in texts])
+
+
+# Input
+# ============================================================================
+
+def mapped_table(file_name):
+    """ `lexemes.TokenTable` of `file_name` mapped in memory. """
+    source = lexemes.mapped_input(file_name)
+    result = lexemes.token_table(source)
+    return result
+
+
+def benchmark_input(paths):
+    """ Compare `lexemes.file_input` with `lexemes.mapped_input`. """
+    file_names = lexer_files(paths)
+    for file_name in file_names:
+        source = lexemes.mapped_input(file_name)
+        mapped = list(lexemes.raw(source))
+        text = source.source[:].decode(lexemes.ENCODING)
+        source.close()
+        if mapped != lexed(lexemes.raw, text):
+            error("Different lexemes for: %s" % file_name)
+    size = sum(os.path.getsize(file_name) for file_name in file_names)
+    print("%i files, %i bytes, same lexemes" % (len(file_names), size))
+    report(
+        "Decoded text",
+        lambda: [
+            lexemes.token_table(lexemes.file_input(file_name))
+            for file_name in file_names])
+    report(
+        "Mapped file",
+        lambda: [mapped_table(file_name) for file_name in file_names])
+
+
+# Which
+# ============================================================================
+
+def loaded_names(paths):
+    """ Names loaded by the ATS files of `paths`, in order of occurrence. """
+    result = []
+    for file_name in lexer_files(paths):
+        text = lexemes.file_input(file_name).source
+        result.extend(LOADED_NAME.findall(text))
+    return result
+
+
+def uncached_which(file_name):
+    """ `environment.which` without its cache. """
+    (candidates, _stamps) = environment.searched_candidates(
+        file_name,
+        True,
+        environment.CURRENT)
+    result = candidates[0] if candidates else None
+    return result
+
+
+def benchmark_which(paths):
+    """ Compare `environment.which` with and without its cache. """
+    names = loaded_names(paths)
+    if not names:
+        error("No loaded names")
+    for name in names:
+        if environment.which(name) != uncached_which(name):
+            error("Different resolution for: %s" % name)
+    found = sum(1 for name in names if environment.which(name) is not None)
+    print("%i names, %i distinct, %i found" % (
+        len(names),
+        len(set(names)),
+        found))
+    for (label, which) in [
+            ("Without cache", uncached_which),
+            ("With cache", environment.which)]:
+        seconds = best_time(
+            lambda which=which: [which(name) for name in names])
+        print("%-32s %10.0f names/s" % (label, len(names) / seconds))
+    # Nothing changes the directories meanwhile, so the listings kept up to
+    # `environment.INDEX_TTL` are not stale.
+    environment.use_directory_index()
+    for name in names:
+        if environment.which(name) != uncached_which(name):
+            error("Different indexed resolution for: %s" % name)
+    seconds = best_time(lambda: [environment.which(name) for name in names])
+    print("%-32s %10.0f names/s" % (
+        "With directory index",
+        len(names) / seconds))
+
+
+# Locations
+# ============================================================================
+
+def json_strings(node):
+    """ Yield the strings of the JSON data `node`. """
+    if isinstance(node, dict):
+        for sub_node in node.values():
+            yield from json_strings(sub_node)
+    elif isinstance(node, list):
+        for sub_node in node:
+            yield from json_strings(sub_node)
+    elif isinstance(node, str):
+        yield node
+
+
+def json_locations(paths):
+    """ Location texts in the JSON data of the ATS files of `paths`. """
+    result = []
+    for file_name in lexer_files(paths):
+        json_object = jsonized.get_json(file_name)
+        if json_object is not None:
+            result.extend(
+                text for text in json_strings(json_object)
+                if locations.LINE_TAG in text)
+    return result
+
+
+# Tags of a location, in order.
+LOCATION_TAGS = [
+    locations.END_OF_PATH,
+    locations.LINE_TAG,
+    locations.OFFS_TAG,
+    locations.END_OF_BEGIN,
+    locations.LINE_TAG,
+    locations.OFFS_TAG,
+    locations.END_OF_END]
+
+
+def searched_parse(text):
+    """ `locations.parse` as it used to: checking `text` searching each tag
+    in turn, then searching them again, to extract the path and numbers. """
+    j = 0
+    for tag in LOCATION_TAGS:
+        i = text.find(tag, j)
+        assert i != -1
+        j = i + len(tag)
+    assert j == len(text)
+    fields = []
+    i = 0
+    for tag in LOCATION_TAGS:
+        j = text.find(tag, i)
+        fields.append(text[i:j])
+        i = j + len(tag)
+    numbers = [int(field) for field in fields[1:]]
+    start = locations.Position(*numbers[:3])
+    end = locations.Position(*numbers[3:])
+    result = locations.Location(fields[0], start, end)
+    return result
+
+
+def unmemoized_parse(texts):
+    """ `locations.parse` of each of `texts`, without its memoization. """
+    parse = locations.parse.__wrapped__
+    result = [parse(text) for text in texts]
+    return result
+
+
+def memoized_parse(texts):
+    """ `locations.parse` of each of `texts`, starting with no memo. """
+    locations.parse.cache_clear()
+    result = [locations.parse(text) for text in texts]
+    return result
+
+
+def benchmark_locations(paths):
+    """ Compare `locations.parse` with its previous implementation. """
+    texts = json_locations(paths)
+    if not texts:
+        error("No locations")
+    for text in texts:
+        if locations.parse(text) != searched_parse(text):
+            error("Different location for: %s" % text)
+    memoized_parse(texts)
+    print("%i locations, %i distinct, %s" % (
+        len(texts),
+        len(set(texts)),
+        locations.parse.cache_info()))
+    for (label, function) in [
+            ("Searching tags", lambda: [searched_parse(x) for x in texts]),
+            ("Regular expression", lambda: unmemoized_parse(texts)),
+            ("Regular expression, memoized", lambda: memoized_parse(texts))]:
+        seconds = best_time(function)
+        print("%-32s %10.0f locations/s" % (label, len(texts) / seconds))
+
+
+# Startup
+# ============================================================================
+
+def import_time(module):
+    """ Import time in seconds of `postiats.module`, in a new process. """
+    name = "postiats." + module
+    package_directory = os.path.dirname(os.path.dirname(__file__))
+    variables = dict(os.environ)
+    variables["PYTHONPATH"] = os.path.abspath(package_directory)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + name],
+        env=variables,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if process.returncode != 0:
+        error("Failed to import %s:\n%s" % (name, process.stderr.strip()))
+    result = None
+    # Lines are “import time: self | cumulative | name”, in microseconds.
+    for line in process.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == name:
+            result = int(fields[1]) / 1000000
+    if result is None:
+        error("Failed to import %s" % name)
+    return result
+
+
+def benchmark_startup(budget):
+    """ Check the import time of the commands modules is within `budget`.
+    """
+    over_budget = False
+    for (command, module) in COMMAND_MODULES:
+        seconds = min(import_time(module) for _i in range(REPEAT))
+        status = "ok"
+        if seconds * 1000 > budget:
+            status = "over budget"
+            over_budget = True
+        print("%-16s %-24s %8.2f ms  %s" % (
+            command,
+            "postiats." + module,
+            seconds * 1000,
+            status))
+    if over_budget:
+        sys.exit(1)
+
+
+# Main
+# ============================================================================
+
+def main():
+    """ Invoked by `../pats-benchmark`. """
+    environment.setup()
+    my_name = os.path.split(sys.argv[0])[1]
+
+    arg_error = True
+
+    if len(sys.argv) == 1:
+        arg_error = False
+        check_lexer(None)
+    if len(sys.argv) == 2:
+        arg1 = sys.argv[1]
+        if arg1 in ["-h", "--help"]:
+            arg_error = False
+            print(HELP % (my_name, STARTUP_BUDGET))
+    if len(sys.argv) == 3:
+        arg1 = sys.argv[1]
+        arg2 = sys.argv[2]
+        if arg1 == "cache-format":
+            arg_error = False
+            benchmark_cache_format(arg2)
+    if len(sys.argv) >= 3:
+        arg1 = sys.argv[1]
+        if arg1 == "filter":
+            arg_error = False
+            benchmark_filter(sys.argv[2:])
+    if len(sys.argv) >= 2:
+        arg1 = sys.argv[1]
+        if arg1 == "lexer":
+            arg_error = False
+            benchmark_lexer(sys.argv[2:])
+        elif arg1 == "relex":
+            arg_error = False
+            benchmark_relex(sys.argv[2:])
+        elif arg1 == "tokens":
+            arg_error = False
+            benchmark_tokens(sys.argv[2:])
+        elif arg1 == "input":
+            arg_error = False
+            benchmark_input(sys.argv[2:])
+        elif arg1 == "which":
+            arg_error = False
+            benchmark_which(sys.argv[2:])
+        elif arg1 == "locations":
+            arg_error = False
+            benchmark_locations(sys.argv[2:])
+        elif arg1 == "startup" and len(sys.argv) <= 3:
+            budget = STARTUP_BUDGET
+            try:
+                budget = float(sys.argv[2]) if len(sys.argv) == 3 else budget
+                arg_error = False
+            except ValueError:
+                pass
+            if not arg_error:
+                benchmark_startup(budget)
+
+    if arg_error:
+        print("ERROR: Invalid argument(s).", file=sys.stderr)
+        print(HELP % (my_name, STARTUP_BUDGET), file=sys.stderr)
+        sys.exit(1)
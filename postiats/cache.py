@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Management of the cache of `jsonized` from the command line.
+
+The cache may be prefilled, purged and listed, and JSON data may be returned
+to stdout.
+
+"""
+
+import copy
+import json
+import os
+import sys
+
+from . import environment
+from . import jsonized
+
+# `concurrent.futures` is imported by the function using it, as `jsonized`
+# does for its own modules, to keep the startup short for `--to-stdout`.
+
+# Constants
+# ============================================================================
+
+HELP = """\
+Usage: %s -h|--help|--to-stdout file|--prefill [--jobs N]|--purge|
+       --directory
+
+Or else used as a Python3 module.
+
+ * -h/--help: display this help.
+ * --to-stdout file: for command line use, return the JSON object to stdout,
+   where file, is a SATS or DATS file.
+ * --prefill: prefill the cache with ATS files from the distribution and
+   the current directory, recursively.
+ * --jobs N: with --prefill, run N `patsopt` processes concurrently. Defaults
+   to the number of CPUs.
+ * --purge: purge the cache directory, removing all JSON, packed, meta,
+   spans and temporary files and directories left empty.
+ * --directory: print the cache directory path.
+
+"""
+
+
+# Scanning directories for prefilling
+# ============================================================================
+
+def files_from_root(root, accept):
+    """ Recursive list of files  in `root` for which `accept` is True. """
+    for (dir_path, _dir_names, file_names) in os.walk(root, followlinks=True):
+        for file_name in file_names:
+            if accept(file_name):
+                path = os.path.join(dir_path, file_name)
+                yield path
+
+
+def files_from_roots(root_dirs, accept):
+    """ `files_from_root` for each non-None root in `root_dirs`. """
+    for root in root_dirs:
+        if root is not None:
+            yield from files_from_root(root, accept)
+
+
+def roots(env):
+    """ Directories scanned for prefilling, in `env`. """
+    result = [env.cwd, env.patshome, env.patscontrib]
+    return result
+
+
+def ats_files(env=None):
+    """ `files_from_roots(roots(env), jsonized.is_ats_file)`. """
+    if env is None:
+        env = environment.CURRENT
+    yield from files_from_roots(roots(env), jsonized.is_ats_file)
+
+
+# JSON data to stdout
+# ============================================================================
+
+def get_json_to_stdout(file_name):
+    """ Print JSON data for `file_name` to stdout.
+
+    Useful to use the cache from the command line too, not only from Python
+    scripts importing `jsonized`.
+
+    """
+    json_object = jsonized.get_json(file_name)
+    if json_object is None:
+        print("Failed to evaluate %s" % file_name, file=sys.stderr)
+        sys.exit(1)
+    json.dump(json_object, sys.stdout)
+    print()
+
+
+# Prefilling, purging and listing
+# ============================================================================
+
+def prefill_file(file_name, env):
+    """ True if `file_name` could be cached in `env`, by `prefill_cache`
+    workers.
+
+    Only a boolean is returned, not the JSON object, which would be costly
+    to send back from a worker process. `env` is copied, not to be changed.
+
+    """
+    env = copy.copy(env)
+    # For the many dependencies. A dependency created or deleted during the
+    # prefill may be missed for up to `environment.INDEX_TTL`, which only
+    # affects the entries it is cached for, as with any concurrent edit.
+    environment.use_directory_index(env)
+    return jsonized.get_json(file_name, env=env) is not None
+
+
+def prefill_results(file_names, jobs, env):
+    """ Yield `prefill_file` results as they complete, using `jobs` workers.
+    """
+    import concurrent.futures  # pylint: disable=import-outside-toplevel
+    if jobs == 1:
+        for file_name in file_names:
+            yield prefill_file(file_name, env)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = [
+                executor.submit(prefill_file, file_name, env)
+                for file_name in file_names]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+
+
+def prefill_cache(jobs=None, env=None):
+    """ Cache jsonized ATS files from distribution and current directory.
+
+    Files are handled by `jobs` worker processes, defaulting to the number
+    of CPUs. With `jobs` equal to 1, files are handled sequentially, in the
+    current process. Either way, the cache ends with the same content.
+
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if env is None:
+        env = environment.CURRENT
+    print("Prefilling cache.")
+    print("\rListing ATS files...", end="")
+    file_names = list(ats_files(env))
+    print("\rListing ATS files: done.")
+    index = 0
+    files_count = len(file_names)
+    cached_count = 0
+    for cached in prefill_results(file_names, jobs, env):
+        index += 1
+        print("\rHandling ATS file #%i of %i" % (index, files_count), end="")
+        if cached:
+            cached_count += 1
+    print("\nDone: %i file(s) cached." % cached_count)
+
+
+def purge_cache():
+    """ Purge cache deleting cache files and directories left empty. """
+    walked = os.walk(jsonized.CACHE, topdown=False)
+    for (dir_path, dir_names, file_names) in walked:
+        for file_name in file_names:
+            if jsonized.is_cache_file(file_name):
+                path = os.path.join(dir_path, file_name)
+                print("Removing file “%s”" % path)
+                os.remove(path)
+        for directory in dir_names:
+            path = os.path.join(dir_path, directory)
+            if not os.listdir(path):
+                print("Removing directory “%s”" % path)
+                os.rmdir(path)
+
+
+def cached_files():
+    """ Yield cached JSON and packed file names. """
+    for (dir_path, _dir_names, file_names) in os.walk(jsonized.CACHE):
+        for file_name in file_names:
+            if (jsonized.is_json_file(file_name) or
+                    jsonized.is_packed_file(file_name)):
+                yield os.path.join(dir_path, file_name)
+
+
+def list_cached():
+    """ Yield tuple (json_name, source_name) for cached files. """
+    for json_name in cached_files():
+        source_name = jsonized.get_source_file_name(json_name)
+        yield (json_name, source_name)
+
+
+# Main
+# ============================================================================
+
+def main():
+
+    """ Main. """
+
+    environment.setup()
+    my_name = os.path.split(sys.argv[0])[1]
+
+    arg_error = True
+
+    if len(sys.argv) == 2:
+        arg1 = sys.argv[1]
+        if arg1 in ["-h", "--help"]:
+            arg_error = False
+            print(HELP % my_name)
+        elif arg1 == "--prefill":
+            arg_error = False
+            prefill_cache()
+        elif arg1 == "--purge":
+            arg_error = False
+            purge_cache()
+        elif arg1 == "--directory":
+            arg_error = False
+            print("Cache directory: %s" % jsonized.CACHE)
+    if len(sys.argv) == 3:
+        arg1 = sys.argv[1]
+        arg2 = sys.argv[2]
+        if arg1 == "--to-stdout":
+            arg_error = False
+            get_json_to_stdout(arg2)
+    if len(sys.argv) == 4:
+        arg1 = sys.argv[1]
+        arg2 = sys.argv[2]
+        arg3 = sys.argv[3]
+        if arg1 == "--prefill" and arg2 == "--jobs":
+            try:
+                jobs = int(arg3)
+            except ValueError:
+                jobs = 0
+            if jobs > 0:
+                arg_error = False
+                prefill_cache(jobs)
+
+    if arg_error:
+        print("ERROR: Invalid argument(s).", file=sys.stderr)
+        print(HELP % my_name, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Client of `server`, forwarding an invocation of a command to it.
+
+A `pats-*` script first tries to have its invocation done by the server,
+which keeps parsed JSON data in memory, and falls back to doing it itself
+when there is no server running. The output is the same either way.
+
+This module imports nothing from the other modules, so that forwarding is
+cheap.
+
+"""
+
+import json
+import os
+import socket
+import stat
+import sys
+
+# Constants
+# ============================================================================
+
+# Environment variables a server must have the same values of, to serve an
+# invocation. They define the search paths and the cache location.
+
+ENVIRONMENT_VARIABLES = [
+    "HOME",
+    "LocalAppData",
+    "PATSCONTRIB",
+    "PATSHOME",
+    "POSTIATS_CONTENT_KEYED",
+    "POSTIATS_DIRECTORY_INDEX",
+    "POSTIATS_PACKED_CACHE",
+    "XDG_CACHE_HOME"]
+
+BUFFER_SIZE = 64 * 1024
+
+# Seconds to wait for the server to accept a connection, then to reply. On a
+# timeout, as with a stuck server, the client does the invocation itself.
+CONNECT_TIMEOUT = 1
+REPLY_TIMEOUT = 60
+
+
+# Socket
+# ============================================================================
+
+def socket_path():
+    """ Path of the server's Unix socket.
+
+    It's `POSTIATS_SOCKET` if this environment variable is set, or else a
+    per-user name in `XDG_RUNTIME_DIR` or in the temporary directory.
+
+    """
+    result = os.getenv("POSTIATS_SOCKET")
+    if not result:
+        directory = os.getenv("XDG_RUNTIME_DIR") or "/tmp"
+        name = "PostiATS-%i.sock" % os.getuid()
+        result = os.path.join(directory, name)
+    return result
+
+
+def is_own_socket(path):
+    """ True if `path` is a socket owned by the current user.
+
+    The socket path is predictable, so another user could create it first,
+    to receive the requests.
+
+    """
+    result = False
+    try:
+        status = os.stat(path)
+        result = (
+            stat.S_ISSOCK(status.st_mode) and
+            status.st_uid == os.getuid())
+    except OSError:
+        pass
+    return result
+
+
+def environment_values():
+    """ Values of `ENVIRONMENT_VARIABLES`, None for the undefined ones. """
+    result = {}
+    for name in ENVIRONMENT_VARIABLES:
+        result[name] = os.getenv(name)
+    return result
+
+
+def receive_all(connection):
+    """ Bytes received from `connection` until the peer shuts down. """
+    chunks = []
+    chunk = connection.recv(BUFFER_SIZE)
+    while chunk:
+        chunks.append(chunk)
+        chunk = connection.recv(BUFFER_SIZE)
+    result = b"".join(chunks)
+    return result
+
+
+def request(command, argv):
+    """ Reply of the server to `command` with `argv`, or None.
+
+    None is returned if no server is running or if it refused to serve the
+    request. Otherwise, the reply is a dictionary with the “stdout”,
+    “stderr” and “status” of the invocation.
+
+    """
+    result = None
+    path = socket_path()
+    if not is_own_socket(path):
+        return None
+    message = {
+        "command": command,
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "environment": environment_values()}
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(CONNECT_TIMEOUT)
+        connection.connect(path)
+        connection.settimeout(REPLY_TIMEOUT)
+        connection.sendall(json.dumps(message).encode("utf-8"))
+        connection.shutdown(socket.SHUT_WR)
+        reply = json.loads(receive_all(connection).decode("utf-8"))
+        if not reply.get("refused"):
+            result = reply
+    except (OSError, ValueError):
+        # OSError includes IOError, socket errors and timeouts.
+        pass
+    connection.close()
+    return result
+
+
+# Forwarding
+# ============================================================================
+
+def forwarded(command):
+    """ True if the server did `command` with `sys.argv`.
+
+    In this case, its output was copied to `stdout` and `stderr`, and the
+    process exits with its status, so this returns only if the server did
+    not do it, returning False. The caller then has to do it itself.
+
+    """
+    reply = request(command, sys.argv)
+    if reply is None:
+        return False
+    sys.stdout.write(reply["stdout"])
+    sys.stdout.flush()
+    sys.stderr.write(reply["stderr"])
+    sys.stderr.flush()
+    sys.exit(reply["status"])
@@ -1,4 +1,10 @@
-""" Collect declarations. """
+""" Collect declarations.
+
+`file_declarations` is a function of the JSON data of a file, returning a
+new `FileDeclarations` each time, so that declarations of many files may be
+collected concurrently and kept together.
+
+"""
 
 import sys
 
@@ -32,65 +38,82 @@ Declaration = namedtuple("Declaration", [
     "type"])
 
 
-DEFS = {
-    t.D2CON_STAMP: {},  # From d2conmap.
-    t.D2CST_STAMP: {},  # From d2cstmap.
-    t.D2VAR_STAMP: {},  # From d2varmap.
-    t.S2CST_STAMP: {},  # From s2cstmap.
-    t.S2VAR_STAMP: {}}  # From s2varmap.
-
-BASE_SORTS = set()
-STATIC_CONSTANTS = {}
-DECLARATIONS = []
-STALOADED = set()
+FileDeclarations = namedtuple("FileDeclarations", [
+    "defs",
+    "base_sorts",
+    "static_constants",
+    "declarations",
+    "staloaded"])
+# Defs is a table of `Def` by stamp for each stamp key, base sorts and
+# staloaded are sets, static constants is a table of sorts by name and
+# declarations is a list of `Declaration`.
+
+STAMP_KEYS = [
+    t.D2CON_STAMP,  # From d2conmap.
+    t.D2CST_STAMP,  # From d2cstmap.
+    t.D2VAR_STAMP,  # From d2varmap.
+    t.S2CST_STAMP,  # From s2cstmap.
+    t.S2VAR_STAMP]  # From s2varmap.
+
+SECTIONS = [
+    t.D2CONMAP,
+    t.D2CSTMAP,
+    t.D2ECLIST,
+    t.D2VARMAP,
+    t.S2CSTMAP,
+    t.S2VARMAP]
+# Top-level sections of the JSON data used here, the only ones to be loaded.
 
 
 # Methods
 # ----------------------------------------------------------------------------
 
-def clear():
-    """ Clear generated data. """
-    for table in DEFS.values():
-        table.clear()
-    BASE_SORTS.clear()
-    STATIC_CONSTANTS.clear()
-    DECLARATIONS.clear()
-    STALOADED.clear()
+def new_file_declarations():
+    """ Empty `FileDeclarations`, to be collected. """
+    result = FileDeclarations(
+        defs={stamp_key: {} for stamp_key in STAMP_KEYS},
+        base_sorts=set(),
+        static_constants={},
+        declarations=[],
+        staloaded=set())
+    return result
 
 
-def add_def(den):
-    """ Add `den` in `DEFS`. """
-    table = DEFS[den.stamp_key]
+def add_def(defs, den):
+    """ Add `den` in `defs`. """
+    table = defs[den.stamp_key]
     if den.stamp in table:
         error("Duplicated stamp: %s." % repr(den.stamp))
     table[den.stamp] = den
 
 
-def get_def(stamp_key, stamp):
-    """ Entry in `DEFS`; may be `None` if missing stamp. """
-    table = DEFS[stamp_key]
+def get_def(defs, stamp_key, stamp):
+    """ Entry in `defs`; may be `None` if missing stamp. """
+    table = defs[stamp_key]
     return table[stamp] if stamp in table else None
 
 
-def update_def(den, new_def):
-    """ Substitue `new_den` for `den` in `DEFS`. """
-    table = DEFS[den.stamp_key]
+def update_def(defs, den, new_def):
+    """ Substitue `new_den` for `den` in `defs`. """
+    table = defs[den.stamp_key]
     if den.stamp not in table:
         error("Missing stamp: %s." % repr(den.stamp))
     table[den.stamp] = new_def
 
 
-def collect_static_constants():
-    """ Fillup `STATIC_CONSTANTS` from previously collected defs.
+def collect_static_constants(collected):
+    """ Fillup `collected.static_constants` from previously collected defs.
 
-    `DEFS` needs to be populated, although it may still be empty after that.
+    `collected.defs` needs to be populated, although it may still be empty
+    after that.
 
     """
-    for den in DEFS[t.S2CST_STAMP].values():
-        STATIC_CONSTANTS[den.name] = den.sort
+    for den in collected.defs[t.S2CST_STAMP].values():
+        collected.static_constants[den.name] = den.sort
 
 
 def add_declaration(
+        collected,
         stamp_key,
         stamp,
         loc,
@@ -100,11 +123,11 @@ def add_declaration(
         typ=None):
     """ Add a declaration possibly complented by a referred def.
 
-    `DEFS` needs to be populated, since `stamp_key` and `stamp` are used
-    as a reference in `DEFS`.
+    `collected.defs` needs to be populated, since `stamp_key` and `stamp`
+    are used as a reference in it.
 
     """
-    den = get_def(stamp_key, stamp)
+    den = get_def(collected.defs, stamp_key, stamp)
     if den is not None:
         declaration = Declaration(
             loc=loc,
@@ -112,17 +135,17 @@ def add_declaration(
             construct=construct,
             sort=sort or den.sort,
             type=typ or den.type)
-        DECLARATIONS.append(declaration)
+        collected.declarations.append(declaration)
     else:
         # error("Missing stamp: %i" % stamp)
         # #include is buggy with stamps.
         pass
 
 
-def add_staloaded(path):
+def add_staloaded(collected, path):
     """ Register a new source reference encoutered in a file. """
     # Invoked from handle_d2cstaload.
-    STALOADED.add(path)
+    collected.staloaded.add(path)
 
 
 # Helpers
@@ -142,17 +165,17 @@ def error(message):
 # Base sorts
 # ============================================================================
 
-def collect_base_sorts(node):
-    """ Fillup `BASE_SORTS`. """
+def collect_base_sorts(base_sorts, node):
+    """ Fillup `base_sorts`. """
     if isinstance(node, dict):
         if t.S2RTBAS in node:
-            BASE_SORTS.add(node[t.S2RTBAS][0])
+            base_sorts.add(node[t.S2RTBAS][0])
         else:
             for sub_node in node.values():
-                collect_base_sorts(sub_node)
+                collect_base_sorts(base_sorts, sub_node)
     elif isinstance(node, list):
         for sub_node in node:
-            collect_base_sorts(sub_node)
+            collect_base_sorts(base_sorts, sub_node)
 
 
 # Maps (x2xxxmap)
@@ -171,6 +194,7 @@ def extract_def(entry, stamp_key, name_key, type_sort):
 
 
 def extract_and_add_defs(
+        defs,
         root_node,
         section_key,
         stamp_key,
@@ -180,13 +204,14 @@ def extract_and_add_defs(
     # type_sort is a function.
     for entry in root_node[section_key]:
         den = extract_def(entry, stamp_key, name_key, type_sort)
-        add_def(den)
+        add_def(defs, den)
 
 
-def collect_defs(root_node):
+def collect_defs(defs, root_node):
     """ Collect defs: their stamp, name, sort and type. """
 
     extract_and_add_defs(
+        defs=defs,
         root_node=root_node,
         section_key=t.D2CONMAP,
         stamp_key=t.D2CON_STAMP,
@@ -194,6 +219,7 @@ def collect_defs(root_node):
         type_sort=d2con_type_sort)
 
     extract_and_add_defs(
+        defs=defs,
         root_node=root_node,
         section_key=t.D2CSTMAP,
         stamp_key=t.D2CST_STAMP,
@@ -201,6 +227,7 @@ def collect_defs(root_node):
         type_sort=d2cst_type_sort)
 
     extract_and_add_defs(
+        defs=defs,
         root_node=root_node,
         section_key=t.D2VARMAP,
         stamp_key=t.D2VAR_STAMP,
@@ -208,6 +235,7 @@ def collect_defs(root_node):
         type_sort=d2var_type_sort)
 
     extract_and_add_defs(
+        defs=defs,
         root_node=root_node,
         section_key=t.S2CSTMAP,
         stamp_key=t.S2CST_STAMP,
@@ -215,6 +243,7 @@ def collect_defs(root_node):
         type_sort=s2cst_type_sort)
 
     extract_and_add_defs(
+        defs=defs,
         root_node=root_node,
         section_key=t.S2VARMAP,
         stamp_key=t.S2VAR_STAMP,
@@ -262,21 +291,21 @@ def s2var_type_sort(entry):
 # General
 # ----------------------------------------------------------------------------
 
-def collect_declarations(root_node):
+def collect_declarations(collected, root_node):
     """ Collect declarations. """
     # Also used by handle_d2cinclude.
     for entry in root_node:
         loc = entry[t.D2ECL_LOC]
         node = entry[t.D2ECL_NODE]
-        dispatch_declaration(loc, node)
+        dispatch_declaration(collected, loc, node)
 
 
-def collect_top_level_declarations(root_node):
+def collect_top_level_declarations(collected, root_node):
     """ Collect declarations. """
-    collect_declarations(root_node[t.D2ECLIST])
+    collect_declarations(collected, root_node[t.D2ECLIST])
 
 
-def dispatch_declaration(loc, wrapper_node):
+def dispatch_declaration(collected, loc, wrapper_node):
     """ Dispatch by “D2Cxxx”. """
     keys = list(wrapper_node.keys())
     if len(keys) != 1:
@@ -285,17 +314,17 @@ def dispatch_declaration(loc, wrapper_node):
     node = wrapper_node[discriminant]
     if discriminant not in DISPATCH_TABLE:
         error("Unknon D2Cxxx: %s" % discriminant)
-    DISPATCH_TABLE[discriminant](loc, node)
+    DISPATCH_TABLE[discriminant](collected, loc, node)
     # The dispatch table is defined later, after each handler is defined.
 
 
 # Specific
 # ----------------------------------------------------------------------------
 
-def complete_var_def(stamp_key, stamp, sort, typ):
+def complete_var_def(defs, stamp_key, stamp, sort, typ):
     """ Workaround lack of type information in d2varmap. """
     assert stamp_key == t.D2VAR_STAMP
-    den = get_def(stamp_key, stamp)
+    den = get_def(defs, stamp_key, stamp)
     assert den is not None
     new_def = Def(
         stamp_key=den.stamp_key,
@@ -304,10 +333,10 @@ def complete_var_def(stamp_key, stamp, sort, typ):
         sort=sort,
         type=typ,
         conss=den.conss)
-    update_def(den, new_def)
+    update_def(defs, den, new_def)
 
 
-def handle_d2cdatdecs(loc, node):
+def handle_d2cdatdecs(collected, loc, node):
     """ Handle a D2Cdatdecs. """
     # The loc argument is that of the keyword, not of the name, and there may
     # be multiple data construction for a say datatype keyword, as in datatype
@@ -329,12 +358,13 @@ def handle_d2cdatdecs(loc, node):
         stamp_key = t.S2CST_STAMP
         stamp = entry[stamp_key]
         add_declaration(
+            collected,
             stamp_key=stamp_key,
             stamp=stamp,
             loc=loc,
             construct=construct)
         # Sort in referred def, but no type.
-        den = get_def(stamp_key, stamp)
+        den = get_def(collected.defs, stamp_key, stamp)
         if den is not None:
             conss = den.conss
             if conss is not None:
@@ -345,13 +375,14 @@ def handle_d2cdatdecs(loc, node):
                 for cons in conss:
                     stamp = cons[stamp_key]
                     add_declaration(
+                        collected,
                         stamp_key=stamp_key,
                         stamp=stamp,
                         loc=loc,
                         construct=construct)
 
 
-def handle_d2cdcstdecs(loc, node):
+def handle_d2cdcstdecs(collected, loc, node):
     """ Handle a D2Cdcstdecs. """
     # The loc argument is that of the keyword, not of the name, and there may
     # be multiple constant construction for a say val keyword, as in val a and
@@ -375,6 +406,7 @@ def handle_d2cdcstdecs(loc, node):
         stamp_key = t.D2CST_STAMP
         stamp = entry[stamp_key]
         add_declaration(
+            collected,
             stamp_key=stamp_key,
             stamp=stamp,
             loc=loc,
@@ -382,7 +414,7 @@ def handle_d2cdcstdecs(loc, node):
         # Type and sort informations are in the referred def.
 
 
-def handle_d2cexndecs(loc, node):
+def handle_d2cexndecs(collected, loc, node):
     """ Handle a D2Cexndecs. """
     # The loc argument is that of the keyword, not of the name, but there
     # is a single name per exception construct.
@@ -392,6 +424,7 @@ def handle_d2cexndecs(loc, node):
         stamp_key = t.D2CON_STAMP
         stamp = item[stamp_key]
         add_declaration(
+            collected,
             stamp_key=stamp_key,
             stamp=stamp,
             loc=loc,
@@ -399,19 +432,19 @@ def handle_d2cexndecs(loc, node):
         # Type and sort informations are in the referred def.
 
 
-def handle_d2cextcode(_loc, _node):
+def handle_d2cextcode(_collected, _loc, _node):
     """ Handle a D2Cextcode. """
     # Not a declaration.
     pass
 
 
-def handle_d2cextvar(_loc, _node):
+def handle_d2cextvar(_collected, _loc, _node):
     """ Handle a D2Cextvar. """
     # No stamp and not a declaration anyway, rather an assignment.
     pass
 
 
-def handle_d2cfundecs(_loc, node):
+def handle_d2cfundecs(collected, _loc, node):
     """ Handle a D2Cfundecs. """
     # The _loc argument is that of the keyword, not of the name, and there may
     # be multiple functions for a say fun keyword, as in fun x and y and z.
@@ -436,6 +469,7 @@ def handle_d2cfundecs(_loc, node):
         stamp = entry[t.F2UNDEC_VAR][stamp_key]
         loc = entry[t.F2UNDEC_LOC]
         add_declaration(
+            collected,
             stamp_key=stamp_key,
             stamp=stamp,
             loc=loc,
@@ -444,13 +478,13 @@ def handle_d2cfundecs(_loc, node):
         # while easier to write a declaration.
 
 
-def handle_d2cignored(_loc, _node):
+def handle_d2cignored(_collected, _loc, _node):
     """ Handle a D2Cignored. """
     # Lost.
     pass
 
 
-def handle_d2cimpdec(_loc, node):
+def handle_d2cimpdec(collected, _loc, node):
     """ Handle a D2Cimpdec. """
     # The _loc argument is that of the keyword, not of the name. Luckyly, we
     # can have the loc of the name, which is better, so the one passed is
@@ -470,6 +504,7 @@ def handle_d2cimpdec(_loc, node):
     # The stamp id is the same as that of the extern function declaration.
     loc = node[1][t.I2MPDEC_LOC]
     add_declaration(
+        collected,
         stamp_key=stamp_key,
         stamp=stamp,
         loc=loc,
@@ -477,31 +512,31 @@ def handle_d2cimpdec(_loc, node):
     # Type and sort informations are in the Def.
 
 
-def handle_d2cinclude(_loc, node):
+def handle_d2cinclude(collected, _loc, node):
     """ Handle a D2Cinclude. """
     # Not a declaration.
-    collect_declarations(node[1])
+    collect_declarations(collected, node[1])
 
 
-def handle_d2clist(_loc, _node):
+def handle_d2clist(_collected, _loc, _node):
     """ Handle a D2Clist. """
     # Not a declaration.
     pass
 
 
-def handle_d2clocal(_loc, _node):
+def handle_d2clocal(_collected, _loc, _node):
     """ Handle a D2C_local. """
     # Not a declaration.
     pass
 
 
-def handle_d2cnone(_loc, _node):
+def handle_d2cnone(_collected, _loc, _node):
     """ Handle a D2Cnone. """
     # Nothing.
     pass
 
 
-def handle_d2coverload(loc, node):
+def handle_d2coverload(collected, loc, node):
     """ Handle a D2Coverload. """
     # The stamp (if there is one) is that of the overladed symbol, not of the
     # ouverloading one.
@@ -523,6 +558,7 @@ def handle_d2coverload(loc, node):
     construct.append(k.OVERLOAD)
     if stamp is not None:
         add_declaration(
+            collected,
             stamp_key=stamp_key,  # Of the overloaded entity.
             stamp=stamp,
             loc=loc,
@@ -532,7 +568,7 @@ def handle_d2coverload(loc, node):
         # D2ITMvar.
 
 
-def handle_d2cstacsts(loc, node):
+def handle_d2cstacsts(collected, loc, node):
     """ Handle a D2Cstacsts. """
     # The loc argument is that of the keyword, not of the name, and there may
     # be multiple constant constructions for a say abstype keyword, as in
@@ -563,6 +599,7 @@ def handle_d2cstacsts(loc, node):
         stamp_key = t.S2CST_STAMP
         stamp = declaration[stamp_key]
         add_declaration(
+            collected,
             stamp_key=stamp_key,
             stamp=stamp,
             loc=loc,
@@ -570,14 +607,14 @@ def handle_d2cstacsts(loc, node):
         # Sort in the referred def but no type.
 
 
-def handle_d2cstaload(_loc, node):
+def handle_d2cstaload(collected, _loc, node):
     """ Handle a D2Cstaload. """
     # Not a declaration, but record it.
     path = node[1]
-    add_staloaded(path)
+    add_staloaded(collected, path)
 
 
-def handle_d2cvaldecs(_loc, node):
+def handle_d2cvaldecs(collected, _loc, node):
     """ Handle a D2Cvaldecs. """
     construct = ["dynamic", "value"]
     construct_tag = node[0]
@@ -596,6 +633,7 @@ def handle_d2cvaldecs(_loc, node):
             stamp_key = t.D2VAR_STAMP
             stamp = var[0][stamp_key]
             add_declaration(
+                collected,
                 stamp_key=stamp_key,
                 stamp=stamp,
                 loc=loc,
@@ -604,11 +642,16 @@ def handle_d2cvaldecs(_loc, node):
                 typ=typ)
             # Type and sort retrieved from pattern if annotated.
             if sort is not None:
-                complete_var_def(stamp_key, stamp, sort, typ)
+                complete_var_def(
+                    collected.defs,
+                    stamp_key,
+                    stamp,
+                    sort,
+                    typ)
                 # For possible later references.
 
 
-def handle_d2cvardecs(_loc, node):
+def handle_d2cvardecs(collected, _loc, node):
     """ Handle a D2Cvardecs. """
     for item in node[0]:
         loc = item[t.V2ARDEC_LOC]
@@ -623,6 +666,7 @@ def handle_d2cvardecs(_loc, node):
             typ = type_node[0][t.S2EXP_NODE]
             sort = type_node[0][t.S2EXP_SRT]
         add_declaration(
+            collected,
             stamp_key=stamp_key,
             stamp=stamp,
             loc=loc,
@@ -631,13 +675,19 @@ def handle_d2cvardecs(_loc, node):
             typ=typ)
         # Type and sort available if annotated.
         if sort is not None:
-            complete_var_def(stamp_key, stamp, sort, typ)
+            complete_var_def(
+                collected.defs,
+                stamp_key,
+                stamp,
+                sort,
+                typ)
             # For possible later references.
         construct = ["static", "value"]
         construct.append(k.VAR)
         stamp_key = t.S2VAR_STAMP
         stamp = item[t.V2ARDEC_SVAR][stamp_key]
         add_declaration(
+            collected,
             stamp_key=stamp_key,
             stamp=stamp,
             loc=loc,
@@ -701,19 +751,29 @@ def p2at_node_p2tvars(node, type_sort=None):
 # Main
 # ============================================================================
 
-def handle_source_file(path):
-    """ Collect declarations and others for one source file.
+def file_declarations(root_node):
+    """ `FileDeclarations` of the JSON data `root_node` of a source file.
+
+    Only the `SECTIONS` of the JSON data are needed.
+
+    """
+    result = new_file_declarations()
+    collect_base_sorts(result.base_sorts, root_node)
+    collect_defs(result.defs, root_node)
+    collect_static_constants(result)  # From previously collected defs.
+    collect_top_level_declarations(result, root_node)
+    return result
+
 
-    Clear before starting to collect.
+def handle_source_file(path, env=None):
+    """ `FileDeclarations` of one source file.
 
-    The path is that of an ATS source file, as the compiler would expect it.
+    The path is that of an ATS source file, as the compiler would expect it
+    in `env`, defaulting to the current environment.
 
     """
-    root_node = jsonized.get_json(path)
+    root_node = jsonized.get_json(path, SECTIONS, env)
     if root_node is None:
         error("Failed to evaluate %s" % path)
-    clear()
-    collect_base_sorts(root_node)
-    collect_defs(root_node)
-    collect_static_constants()  # From previously collected defs.
-    collect_top_level_declarations(root_node)
+    result = file_declarations(root_node)
+    return result
@@ -5,6 +5,7 @@
 
 import os
 import sys
+import time
 
 # Environment definitions
 # ============================================================================
@@ -46,102 +47,184 @@ import sys
 # > I changed the implementation a bit to support recursive substitution;
 # > the maximal recursion depth is set to be 100.
 
-# Search paths
+# Search paths and path variables
 # ----------------------------------------------------------------------------
+#
+# `PATHLST` is filled with `-IATS` command line arguments and `PREPATHLST`
+# with only `PATSHOME` so far. The search directories are the current
+# directory, then `PATHLST`, then `PREPATHLST`, by definition.
+#
+# Path variables are prefilled with `PATSHOME` and `PATSCONTRIB`, and
+# completed with `-(DD|D)ATS XYZ_targetloc=something` command line
+# arguments.
 
-CWD = os.getcwd()
-PATSHOME = os.getenv("PATSHOME")
+VARIABLE_SUFFIX = "_targetloc"
+REC_SUBST_MAX_DEPTH = 100
 
-PATHLST = []  # Filled with `-IATS` command line arguments
-PREPATHLST = []  # Filled with only `PATSHOME` so far.
 
-if PATSHOME is not None:
-    PREPATHLST.append(PATSHOME)
-else:
-    print(
-        "WARNING: the `PATSHOME` environment variable isn't set.",
-        file=sys.stderr)
+class Environment:
 
-SEARCH_DIRECTORIES = [CWD] + PATHLST + PREPATHLST  # Order by definition.
+    """ Search directories and path variables, as for `patsopt`.
 
+    An environment is built once, by `from_args`, and is not modified
+    after, except by `use_directory_index`. It can be pickled, to be sent
+    to worker processes.
 
-def handle_iats_args():
-    """ Interpret and delete `-IATS` arguments in `sys.argv`.
+    """
 
-    Each `-IATS` argument value is added to `PATHLST` in the order there
-    appear. `-IIATS` arguments are handled like `-IATS`.
+    __slots__ = [
+        "cwd",
+        "patshome",
+        "patscontrib",
+        "pathlst",
+        "prepathlst",
+        "search_directories",
+        "path_variables",
+        "directory_indexed"]
+
+    def __init__(self, cwd, patshome, patscontrib, pathlst, targetlocs):
+        self.cwd = cwd
+        self.patshome = patshome
+        self.patscontrib = patscontrib
+        self.pathlst = list(pathlst)
+        self.prepathlst = [] if patshome is None else [patshome]
+        self.search_directories = [cwd] + self.pathlst + self.prepathlst
+        self.path_variables = {}
+        if patshome is not None:
+            self.path_variables["PATSHOME"] = patshome
+        if patscontrib is not None:
+            self.path_variables["PATSCONTRIB"] = patscontrib
+        self.path_variables.update(targetlocs)
+        self.directory_indexed = DIRECTORY_INDEX_DEFAULT
+
+
+def iats_args(argv):
+    """ `(pathlst, rest)` from `-IATS` arguments in `argv`.
+
+    Each `-IATS` argument value is added to `pathlst` in the order there
+    appear. `-IIATS` arguments are handled like `-IATS`. `rest` is `argv`
+    without these arguments. `argv[0]`, the program name, is not checked.
 
     """
+    pathlst = []
+    rest = list(argv[:1])
     i = 1
-    while i < len(sys.argv):
-        if sys.argv[i] in ["-IATS", "-IIATS"]:
-            del sys.argv[i]
-            if i < len(sys.argv):
-                path = sys.argv[i]
-                del sys.argv[i]
-                PATHLST.append(path)
+    while i < len(argv):
+        if argv[i] in ["-IATS", "-IIATS"]:
+            i += 1
+            if i < len(argv):
+                pathlst.append(argv[i])
+                i += 1
             else:
-                # PATHLST.append("")  Redundant with `CWD`.
+                # pathlst.append("")  Redundant with the current directory.
                 pass
         else:
+            rest.append(argv[i])
             i += 1
+    return (pathlst, rest)
 
 
-handle_iats_args()
-
-# Path variables
-# ----------------------------------------------------------------------------
-VARIABLE_SUFFIX = "_targetloc"
-REC_SUBST_MAX_DEPTH = 100
-
-PATSCONTRIB = os.getenv("PATSCONTRIB")
-
-PATH_VARIABLES = {}
-# Prefilled with `PATSHOME` and `PATSCONTRIB`.
-# Completed with `-(DD|D)ATS XYZ_targetloc=something` command line arguments.
-
-if PATSHOME is not None:
-    PATH_VARIABLES["PATSHOME"] = PATSHOME
-
-if PATSCONTRIB is not None:
-    PATH_VARIABLES["PATSCONTRIB"] = PATSCONTRIB
-else:
-    print(
-        "WARNING: the `PATSCONTRIB` environment variable isn't set.",
-        file=sys.stderr)
-
-
-def handle_dats_args():
-    """ Interpret and delete `-DATS` arguments in `sys.argv`.
+def dats_args(argv):
+    """ `(targetlocs, rest)` from `-DATS` arguments in `argv`.
 
     Only the `-DATS` arguments of the form `-DATS XYZ_targetloc=something` has
     an effect: the key “XYZ” with value “something” is added to
-    `PATH_VARIABLES`. Others `-DATS` arguments are read, however dropped.
+    `targetlocs`. Others `-DATS` arguments are read, however dropped.
 
-     `-DDATS` arguments are handled like `-DATS`.
+     `-DDATS` arguments are handled like `-DATS`. `rest` is `argv` without
+     these arguments. `argv[0]`, the program name, is not checked.
 
     """
+    targetlocs = {}
+    rest = list(argv[:1])
     i = 1
-    while i < len(sys.argv):
-        if sys.argv[i] in ["-DATS", "-DDATS"]:
-            del sys.argv[i]
-            if i < len(sys.argv):
-                arg = sys.argv[i]
-                del sys.argv[i]
-                pair = arg.split("=", 1)
+    while i < len(argv):
+        if argv[i] in ["-DATS", "-DDATS"]:
+            i += 1
+            if i < len(argv):
+                pair = argv[i].split("=", 1)
+                i += 1
                 if len(pair) == 2:
                     (name, value) = pair
                     if name.endswith(VARIABLE_SUFFIX):
                         name = name[:-len(VARIABLE_SUFFIX)]
-                        PATH_VARIABLES[name] = value
-
+                        targetlocs[name] = value
         else:
+            rest.append(argv[i])
             i += 1
+    return (targetlocs, rest)
+
+
+def from_args(argv, cwd=None, variables=None):
+    """ `(env, rest)` from `argv` and environment `variables`.
 
+    `cwd` defaults to the current directory and `variables` to `os.environ`.
+    `rest` is `argv` without the `-IATS` and `-DATS` arguments, which is
+    not modified.
 
-handle_dats_args()
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    if variables is None:
+        variables = os.environ
+    (pathlst, rest) = iats_args(argv)
+    (targetlocs, rest) = dats_args(rest)
+    result = Environment(
+        cwd,
+        variables.get("PATSHOME"),
+        variables.get("PATSCONTRIB"),
+        pathlst,
+        targetlocs)
+    return (result, rest)
+
+
+def warn(env):
+    """ Print warnings about `env` to `stderr`. """
+    if env.patshome is None:
+        print(
+            "WARNING: the `PATSHOME` environment variable isn't set.",
+            file=sys.stderr)
+    if env.patscontrib is None:
+        print(
+            "WARNING: the `PATSCONTRIB` environment variable isn't set.",
+            file=sys.stderr)
+
+
+# Current environment
+# ----------------------------------------------------------------------------
+#
+# Functions taking an optional environment use `CURRENT` by default. Until a
+# command sets it up, it's from the environment variables only, without any
+# warning.
+
+DIRECTORY_INDEX_DEFAULT = os.getenv("POSTIATS_DIRECTORY_INDEX") is not None
+
+CURRENT = from_args([])[0]
+
+
+def use(env):
+    """ Make `env` the `CURRENT` environment. """
+    global CURRENT
+    CURRENT = env
+
+
+def setup():
+    """ Set up `CURRENT` for a command, from `sys.argv`.
+
+    The `-IATS` and `-DATS` arguments are deleted from `sys.argv` and the
+    warnings are printed. This is for the `main` of commands, which may be
+    invoked by `server` in another directory with other arguments.
+
+    """
+    (env, sys.argv[:]) = from_args(sys.argv)
+    warn(env)
+    use(env)
+    return env
 
 
+# Path variables substitution
+# ----------------------------------------------------------------------------
+
 def is_variable_name_char(char):
     """ If char is alpha‑numeric or underscore. """
     result = char.isalnum() or char == "_"
@@ -196,8 +279,8 @@ def find_variable(text, start):
     return result
 
 
-def variables_substituted(text):
-    """ Substitute path variables to their values.
+def variables_substituted(text, env=None):
+    """ Substitute path variables of `env` to their values.
 
     The variable may be of two forms: `$XYZ` or `{$XYZ}`. The latter is to
     be used when otherwise the variable name would be followed by a name
@@ -207,6 +290,9 @@ def variables_substituted(text):
     own name.
 
     """
+    if env is None:
+        env = CURRENT
+    path_variables = env.path_variables
     recursion_depth = 0
     result = text
     changed = True
@@ -224,8 +310,8 @@ def variables_substituted(text):
                 break
             # pylint: disable=unpacking-non-sequence
             (name, var_start, var_end) = variable
-            if name in PATH_VARIABLES:
-                substitution = PATH_VARIABLES[name]
+            if name in path_variables:
+                substitution = path_variables[name]
             else:
                 substitution = name
             result += source[i:var_start]  # Seg. after prev., before current.
@@ -241,6 +327,36 @@ def variables_substituted(text):
 # Searching for files
 # ============================================================================
 
+# Resolutions cache, used by `get_candidates`. Misses are cached the same,
+# with an empty list of candidates. A change of the permissions of a file,
+# which does not modify its directory, is not noticed.
+
+RESOLUTIONS_ENTRIES = 4096  # Maximum number of entries, before clearing.
+
+RESOLUTIONS = {}
+
+# Directory index, used instead of `is_readable` with an environment with
+# `directory_indexed`. Each directory is listed once, and listed again only
+# if modified, which is checked at most every `INDEX_TTL` seconds. A listed
+# file is checked to be readable with `os.access`, without opening it.
+
+INDEX_TTL = 1.0
+
+DIRECTORY_INDEX = {}
+
+
+class IndexEntry:
+
+    """ Files of a directory, at a modification time, checked at a time. """
+
+    __slots__ = ["checked", "stamp", "names"]
+
+    def __init__(self, checked, stamp, names):
+        self.checked = checked
+        self.stamp = stamp
+        self.names = names
+
+
 def is_readable(path):
     """ True if `file_name` can be opened for reading. """
     result = False
@@ -254,55 +370,177 @@ def is_readable(path):
     return result
 
 
-def find_in_directory(directory, file_name):
-    """ Search for `file_name` in `directory`, return its path or None.
+def directory_stamp(directory):
+    """ Modification time of `directory`, or None if it does not exist. """
+    try:
+        result = os.stat(directory).st_mtime_ns
+    except OSError:
+        result = None
+    return result
+
 
-    Search is not recursive. Postiats search path works like the usual `PATH`
-    environment variable. The file must not only exists as a directory entry,
-    it also must be readable as a file (so file permissions matters).
+def search_paths(file_name, env):
+    """ Normalized paths to search for `file_name`, by priority.
 
-    If a path is returned, it is normalized (without any “.” or “..”).
+    Search is not recursive. Postiats search path works like the usual
+    `PATH` environment variable: these are the paths of `file_name` in each
+    of the search directories of `env`, or a single one if `file_name` is
+    absolute. Don't return the same result multiple times: with an absolute
+    path, the result would be the same for all search directories.
 
-    `file_name` is assumed to already have variables substitution applied.
+    The paths are normalized (without any “.” or “..”). A candidate must
+    not only exist as a directory entry, it also must be readable as a
+    file (so file permissions matters).
 
     """
-    result = None
-    directory = variables_substituted(directory)
-    path = os.path.join(directory, file_name)
-    path = os.path.normpath(path)
-    if is_readable(path):
-        result = path
+    file_name = variables_substituted(file_name, env)
+    if os.path.isabs(file_name):
+        result = [os.path.normpath(file_name)]
+    else:
+        result = [
+            os.path.normpath(
+                os.path.join(variables_substituted(directory, env), file_name))
+            for directory in env.search_directories]
     return result
 
 
-def get_candidates(file_name, stop_at_first):
-    """ For implementation of `which` and `which_candidates`. """
+def searched_candidates(file_name, stop_at_first, env):
+    """ `(candidates, stamps)`, for `get_candidates`.
+
+    `stamps` is a list of `(directory, directory_stamp(directory))`, for
+    the directories searched. Each stamp is taken before the search in the
+    directory.
+
+    """
+    candidates = []
+    stamps = []
+    for path in search_paths(file_name, env):
+        directory = os.path.dirname(path)
+        stamps.append((directory, directory_stamp(directory)))
+        if is_readable(path):
+            candidates.append(path)
+            if stop_at_first:
+                break
+    return (candidates, stamps)
+
+
+def listed_files(directory):
+    """ Names of the files in `directory`, empty if it can't be listed. """
+    result = frozenset()
+    try:
+        with os.scandir(directory) as entries:
+            result = frozenset(
+                entry.name for entry in entries if entry.is_file())
+    except OSError:
+        # Includes FileNotFoundError and NotADirectoryError
+        pass
+    return result
+
+
+def indexed_files(directory):
+    """ Names of the files in `directory`, from `DIRECTORY_INDEX`. """
+    now = time.monotonic()
+    entry = DIRECTORY_INDEX.get(directory)
+    if entry is None or now - entry.checked > INDEX_TTL:
+        stamp = directory_stamp(directory)
+        if entry is None or stamp != entry.stamp:
+            names = frozenset()
+            if stamp is not None:
+                names = listed_files(directory)
+            entry = IndexEntry(now, stamp, names)
+            DIRECTORY_INDEX[directory] = entry
+        else:
+            entry.checked = now
+    return entry.names
+
+
+def indexed_candidates(file_name, stop_at_first, env):
+    """ Candidates for `get_candidates`, from `DIRECTORY_INDEX`. """
     result = []
-    file_name = variables_substituted(file_name)
-    stop_at_first = stop_at_first or os.path.isabs(file_name)
-    # Don't return the same result multiple times: with an absolute path, the
-    # result will be the same, for all search directories.
-    first = True
-    for directory in SEARCH_DIRECTORIES:
-        found = find_in_directory(directory, file_name)
-        if found is not None:
-            result.append(found)
-            if first and stop_at_first:
+    for path in search_paths(file_name, env):
+        (directory, name) = os.path.split(path)
+        if (name in indexed_files(directory) and
+                os.access(path, os.R_OK)):
+            result.append(path)
+            if stop_at_first:
                 break
-            first = False
     return result
 
 
-def which(file_name):
-    """ Like the UNIX `which` command, for files in Postiats search path. """
+def use_directory_index(env=None):
+    """ Search files of `env` with `DIRECTORY_INDEX`, as for bulk
+    resolutions.
+
+    A directory is checked again only `INDEX_TTL` seconds after it was
+    listed, so a file added or removed within this delay may be missed, or
+    still found. This is only for runs over files which are not being
+    edited meanwhile.
+
+    """
+    if env is None:
+        env = CURRENT
+    env.directory_indexed = True
+
+
+def is_up_to_date(stamps):
+    """ True if the directories of `stamps` were not modified since. """
+    result = all(
+        directory_stamp(directory) == stamp
+        for (directory, stamp) in stamps)
+    return result
+
+
+def get_candidates(file_name, stop_at_first, env=None):
+    """ For implementation of `which` and `which_candidates`.
+
+    Results are cached in `RESOLUTIONS`, with the directories searched and
+    their modification times, found or not found. A cached result is used
+    while none of these directories is modified, which is checked with a
+    single `stat` per directory, as adding, removing or renaming an entry
+    modifies its directory.
+
+    With `directory_indexed`, the directory index is used instead, without
+    this cache.
+
+    """
+    if env is None:
+        env = CURRENT
+    if env.directory_indexed:
+        return indexed_candidates(file_name, stop_at_first, env)
+    key = (
+        file_name,
+        stop_at_first,
+        os.getcwd(),
+        tuple(env.search_directories),
+        tuple(sorted(env.path_variables.items())))
+    entry = RESOLUTIONS.get(key)
+    if entry is not None and is_up_to_date(entry[1]):
+        result = list(entry[0])
+    else:
+        (result, stamps) = searched_candidates(
+            file_name,
+            stop_at_first,
+            env)
+        if len(RESOLUTIONS) >= RESOLUTIONS_ENTRIES:
+            RESOLUTIONS.clear()
+        RESOLUTIONS[key] = (list(result), stamps)
+    return result
+
+
+def which(file_name, env=None):
+    """ Like the UNIX `which` command, for files in Postiats search path.
+
+    The search path is that of `env`, defaulting to `CURRENT`.
+
+    """
     result = None
-    candidates = get_candidates(file_name, stop_at_first=True)
+    candidates = get_candidates(file_name, True, env)
     if candidates:
         result = candidates[0]
     return result
 
 
-def which_candidates(file_name):
+def which_candidates(file_name, env=None):
     """ Like `which`, except it returns a list of all candidates.
 
     Candidates are listed by priority. The first one is the one which would
@@ -310,7 +548,7 @@ def which_candidates(file_name):
     an empty list is returned (where `which` would return None).
 
     """
-    result = get_candidates(file_name, stop_at_first=False)
+    result = get_candidates(file_name, False, env)
     return result
 
 
@@ -319,6 +557,7 @@ def which_candidates(file_name):
 
 def main():
     """ Invoked by `../pats-which`. """
+    setup()
     my_name = os.path.split(sys.argv[0])[1]
     if len(sys.argv) == 2:
         file_name = sys.argv[1]
@@ -3,9 +3,6 @@
 
 """ Filter for PostiATS messages. """
 
-import os
-import sys
-
 from collections import namedtuple
 from enum import Enum
 
@@ -41,6 +38,7 @@ START_OF_MSG_LEVEL = ": "
 END_OF_MSG_LEVEL = ": "
 SHOWTYPE_START = "**SHOWTYPE[UP]**("
 SHOWTYPE_END = "): "
+SHOWTYPE_TEXT_PREFIX = "$showtype: "
 
 
 # Methods
@@ -116,7 +114,7 @@ def parse_showtype_message(line):
     j = i + len(SHOWTYPE_END)
     level = 3
 
-    text = "$showtype: " + line[j:]
+    text = SHOWTYPE_TEXT_PREFIX + line[j:]
 
     result = Message(
         location=location,
@@ -131,7 +129,7 @@ def parse_showtype_message(line):
 class String(object):
     """ String iterator with indexes stack. """
 
-    __slots__ = ["string", "index", "indexes", "len"]
+    __slots__ = ["string", "index", "indexes", "len", "memo"]
 
     def __init__(self, string):
         """ Assign content to `string` and initializes index and stack. """
@@ -139,6 +137,7 @@ class String(object):
         self.index = 0
         self.indexes = []
         self.len = len(string)
+        self.memo = {}  # Used by `parse_node`.
 
     def print_head(self):
         """ For debugging. """
@@ -394,8 +393,17 @@ def get_end_kind(string):
 
 
 def parse_node(string):
-    """ A Node or None. """
+    """ A Node or None.
+
+    The result and the index after, only depends on the index before, so
+    they are memoized in `string.memo`, which makes each node parsed once.
+
+    """
     # High level parsing based on token kind.
+    start = string.index
+    if start in string.memo:
+        (result, string.index) = string.memo[start]
+        return result
     result = None
     token = None
     kind = False
@@ -420,6 +428,7 @@ def parse_node(string):
             kind=kind,
             nodes=nodes,
             end=end)
+    string.memo[start] = (result, string.index)
     return result
 
 
@@ -908,95 +917,3 @@ def simplified_image(node, level, acc):
         for method in SIMPLIFIED_IMAGE_METHODS:
             result = result or method(node, level, acc)
     return result
-
-
-# Main
-# ============================================================================
-
-def is_root_node(node):
-    """ True if node is a D2/S2/C3 node followed by end. """
-    result = (
-        node is not None and
-        node.kind == KIND.D2S2C3 and
-        node.end == FOLLOWED_BY.END)
-    return result
-
-
-def pretty_printed(string):
-    """ String with Postiats expressions folded and re‑printed below. """
-    fold_count = 0
-    result = ""
-    trees = []
-    string = String(string)
-
-    def append_folded_ref():
-        """ Append a “[n]” in place of the parsed expression. """
-        nonlocal fold_count, string, result
-        # pylint: disable=unused-variable
-        fold_count += 1
-        if not string.has_item() or string.item() != "]":
-            result += "[%i]" % fold_count
-        else:
-            result += "%i" % fold_count
-
-    def append_folded_ref_target(lines):
-        """ Append an “[n]:” before a pretty printed expression. """
-        nonlocal fold_count, result
-        # pylint: disable=unused-variable
-        fold_count += 1
-        result += "[%i]: " % fold_count
-        if len(lines) > 1:
-            result += "\n"
-
-    while string.has_item():
-        string.push()
-        tree = parse_node(string)  # The magic is here
-        if is_root_node(tree):
-            string.unpush()
-            append_folded_ref()
-            trees.append(tree)
-        else:
-            string.pop()
-            result += string.item()
-            string.consume()
-
-    result += "\n"
-    fold_count = 0
-    for tree in trees:
-        lines = node_lines_image(tree)  # The magic is here
-        lines = format_lines(lines)
-        append_folded_ref_target(lines)
-        result += lines_image(lines)
-    return result
-
-
-def main():
-    """ Invoked by `../pats-filter`. """
-    my_name = os.path.split(sys.argv[0])[1]
-    if len(sys.argv) != 1:
-        print("%s takes no parameter, just input." % my_name, file=sys.stderr)
-        exit(1)
-    message_before = False  # For managing additional blank lines.
-    for line in sys.stdin:
-        line = line.strip()
-        if is_message_with_location(line):
-            message = parse_message_with_location(line)
-        elif is_showtype_message(line):
-            message = parse_showtype_message(line)
-        else:
-            message = None
-        if message:
-            text = pretty_printed(message.text)
-            location = message.location
-            output = "%s: %s" % (
-                locations.ide_formated(location, LOCATION_WITH_COLUMN),
-                text)
-            print()  # Separate messages with blank lines.
-            print(output, end="")
-            message_before = True
-        else:
-            output = pretty_printed(line)
-            if message_before:
-                print()  # Separate from messages with blank lines.
-            print(output, end="")
-            message_before = False
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Filtering of PostiATS output lines, with the parsing of `filter`.
+
+Messages and expressions images are cached, expressions are folded, and
+lines are filtered one by one, by batches with `--jobs` or by chunks with
+`--stream`, see `streaming`.
+
+"""
+
+import collections
+import itertools
+import os
+import re
+import sys
+
+from . import filter as message_filter
+from . import locations
+
+# The modules only needed by `--stream` and `--jobs` are imported by the
+# functions using them, to keep the startup short without these options.
+
+# Configuration (editable)
+# ============================================================================
+
+# Bounds of the caches of images, see `Cache`.
+CACHE_ENTRIES = 1024
+CACHE_SIZE = 16 * 1024 * 1024  # Characters of keys and values.
+
+# For `--jobs`, see `filtered_lines`.
+BATCH_LINES = 4096  # Lines read and handed to the workers at once.
+
+
+# Images cache
+# ============================================================================
+
+# The same messages and expressions often come many times in a compiler
+# output, as an unsolved constraint reported at different locations. Their
+# images are cached, by message text and by expression text: the image of
+# an expression only depends on its text, since the parse of a root node
+# does not depend on what follows it.
+
+class Cache(object):
+    """ Least recently used strings by strings, with hit and miss counts.
+
+    It keeps at most `CACHE_ENTRIES` entries and `CACHE_SIZE` characters.
+
+    """
+
+    __slots__ = ["entries", "size", "hits", "misses"]
+
+    def __init__(self):
+        """ Empty cache. """
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Value for `key` or None. """
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, value):
+        """ Set `value` for `key`, which is assumed to be missing. """
+        size = len(key) + len(value)
+        if size > CACHE_SIZE:
+            return
+        self.entries[key] = value
+        self.size += size
+        while len(self.entries) > CACHE_ENTRIES or self.size > CACHE_SIZE:
+            (old_key, old_value) = self.entries.popitem(last=False)
+            self.size -= len(old_key) + len(old_value)
+
+    def stats(self):
+        """ Text of the hit and miss counts. """
+        count = self.hits + self.misses
+        rate = 100 * self.hits / count if count else 0
+        result = "%i hits, %i misses, %.1f%% hit rate" % (
+            self.hits,
+            self.misses,
+            rate)
+        return result
+
+
+MESSAGE_IMAGES = Cache()  # `pretty_printed` by its argument.
+EXPRESSION_IMAGES = Cache()  # `expression_image` by expression text.
+
+
+def expression_image(tree, source):
+    """ Pretty printed `tree`, whose text is `source`, after its “[n]: ”.
+    """
+    result = EXPRESSION_IMAGES.get(source)
+    if result is None:
+        lines = message_filter.node_lines_image(tree)  # The magic is here
+        lines = message_filter.format_lines(lines)
+        result = message_filter.lines_image(lines)
+        if len(lines) > 1:
+            result = "\n" + result
+        EXPRESSION_IMAGES.put(source, result)
+    return result
+
+
+def print_stats():
+    """ Print the caches statistics to `stderr`. """
+    print("Messages: %s." % MESSAGE_IMAGES.stats(), file=sys.stderr)
+    print("Expressions: %s." % EXPRESSION_IMAGES.stats(), file=sys.stderr)
+
+
+# Folding
+# ============================================================================
+
+def is_root_node(node):
+    """ True if node is a D2/S2/C3 node followed by end. """
+    result = (
+        node is not None and
+        node.kind == message_filter.KIND.D2S2C3 and
+        node.end == message_filter.FOLLOWED_BY.END)
+    return result
+
+
+# Where a root node may start: a `parse_d2s2c3_name` prefix.
+ROOT_NODE_START = re.compile("D2|S2|C3")
+
+
+def folded(string):
+    """ `(pieces, trees, sources)` for the expressions in `string`.
+
+    The concatenation of `pieces` is `string` with the expressions folded as
+    “[n]” references, `trees` is the list of the root nodes parsed and
+    `sources` is the list of their texts.
+
+    """
+    pieces = []
+    trees = []
+    sources = []
+    text = string
+    string = message_filter.String(text)
+    position = 0  # End of the text already in pieces.
+    match = ROOT_NODE_START.search(text)
+    while match is not None:
+        start = match.start()
+        string.index = start
+        tree = message_filter.parse_node(string)  # The magic is here
+        if is_root_node(tree):
+            pieces.append(text[position:start])
+            position = string.index
+            if not string.has_item() or string.item() != "]":
+                pieces.append("[%i]" % (len(trees) + 1))
+            else:
+                pieces.append("%i" % (len(trees) + 1))
+            trees.append(tree)
+            sources.append(text[start:position])
+            match = ROOT_NODE_START.search(text, position)
+        else:
+            match = ROOT_NODE_START.search(text, start + 1)
+    pieces.append(text[position:])
+    return (pieces, trees, sources)
+
+
+def pretty_printed(string):
+    """ String with Postiats expressions folded and re‑printed below.
+
+    A parse is attempted only where a root node may start, and as nodes
+    parsing is memoized, this is linear in the length of `string`. Results
+    are cached in `MESSAGE_IMAGES`.
+
+    """
+    cached = MESSAGE_IMAGES.get(string)
+    if cached is not None:
+        return cached
+    (result, trees, sources) = folded(string)
+    result.append("\n")
+    fold_count = 0
+    for (tree, source) in zip(trees, sources):
+        fold_count += 1
+        result.append("[%i]: " % fold_count)
+        result.append(expression_image(tree, source))
+    result = "".join(result)
+    MESSAGE_IMAGES.put(string, result)
+    return result
+
+
+# Input lines
+# ============================================================================
+
+def filtered_line(line):
+    """ `(output, is_message)` for an input `line`. """
+    line = line.strip()
+    if message_filter.is_message_with_location(line):
+        message = message_filter.parse_message_with_location(line)
+    elif message_filter.is_showtype_message(line):
+        message = message_filter.parse_showtype_message(line)
+    else:
+        message = None
+    if message:
+        text = pretty_printed(message.text)
+        location = message.location
+        output = "%s: %s" % (
+            locations.ide_formated(
+                location,
+                message_filter.LOCATION_WITH_COLUMN),
+            text)
+    else:
+        output = pretty_printed(line)
+    result = (output, bool(message))
+    return result
+
+
+def filtered_lines(lines, jobs=1):
+    """ Yield `filtered_line` for each of `lines`, in order.
+
+    With `jobs` greater than 1, lines are handled by as many worker
+    processes, by batches of `BATCH_LINES`, a batch being handled while the
+    results of the previous one are yielded.
+
+    """
+    if jobs == 1:
+        for line in lines:
+            yield filtered_line(line)
+    else:
+        import concurrent.futures  # pylint: disable=import-outside-toplevel
+        lines = iter(lines)
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            previous = []
+            batch = list(itertools.islice(lines, BATCH_LINES))
+            while batch:
+                chunk_size = max(1, len(batch) // (4 * jobs))
+                results = executor.map(
+                    filtered_line,
+                    batch,
+                    chunksize=chunk_size)
+                yield from previous
+                previous = results
+                batch = list(itertools.islice(lines, BATCH_LINES))
+            yield from previous
+
+
+def print_filtered(results):
+    """ Print `filtered_lines` `results`, separating messages. """
+    message_before = False  # For managing additional blank lines.
+    for (output, is_message) in results:
+        if is_message:
+            print()  # Separate messages with blank lines.
+        elif message_before:
+            print()  # Separate from messages with blank lines.
+        print(output, end="")
+        message_before = is_message
+
+
+def input_lines(file_names):
+    """ Yield the lines of the files named `file_names`, or of `stdin`. """
+    if not file_names:
+        yield from sys.stdin
+    for file_name in file_names:
+        try:
+            source = open(file_name, "r")
+        except OSError as error:
+            # Includes IOError
+            print("Can't read %s: %s" % (file_name, error), file=sys.stderr)
+            exit(1)
+        with source:
+            yield from source
+
+
+# Main
+# ============================================================================
+
+HELP = """\
+Usage: %s -h|--help|[--stats] [--stream|[--jobs N] [file...]]
+
+Pretty print the PostiATS messages in the files, or else in stdin.
+
+ * -h/--help: display this help.
+ * --stats: print the caches hit rates to stderr at the end.
+ * --stream: write the output of a line while the line is read from stdin,
+   for huge lines. Memory is not bounded by the size of a line, but it still
+   grows with the size of the largest expression in a line. A single huge
+   type, as in a **SHOWTYPE[UP]** message, is held in memory as a whole.
+ * --jobs N: pretty print the lines with N worker processes. The output is
+   the same. Not with --stats, as the caches are those of the workers.
+"""
+
+
+def main():
+    """ Invoked by `../pats-filter`.
+
+    With `--stats`, the caches statistics are printed to `stderr` at the
+    end. This is not available with `--jobs`, as the caches are those of
+    the workers.
+
+    """
+    my_name = os.path.split(sys.argv[0])[1]
+    args = sys.argv[1:]
+    if args in [["-h"], ["--help"]]:
+        print(HELP % my_name)
+        return
+    stats = args[:1] == ["--stats"]
+    if stats:
+        args = args[1:]
+    streamed = args[:1] == ["--stream"]
+    if streamed:
+        args = args[1:]
+    jobs = 1
+    if args[:1] == ["--jobs"] and not stats and not streamed:
+        try:
+            jobs = int(args[1])
+        except (IndexError, ValueError):
+            jobs = 0
+        args = args[2:]
+    if (jobs < 1 or
+            (streamed and args) or
+            any(arg.startswith("-") for arg in args)):
+        print(HELP % my_name, file=sys.stderr)
+        exit(1)
+    if streamed:
+        from . import streaming  # pylint: disable=import-outside-toplevel
+        streaming.stream(sys.stdin, sys.stdout)
+    else:
+        print_filtered(filtered_lines(input_lines(args), jobs))
+    if stats:
+        print_stats()
@@ -1,5 +1,11 @@
-""" Text images of expressions. """
+""" Text images of expressions.
 
+Images of types refer to the defs of a file, as in
+`declarations.FileDeclarations`, passed as `defs`.
+
+"""
+
+import functools
 import sys
 
 from . import constants as c
@@ -73,7 +79,7 @@ def sort_image(node, paren_if_fun=False):
 # Quantified expression image
 # ============================================================================
 
-def quantified_exp_image(node, key_image, open_close):
+def quantified_exp_image(defs, node, key_image, open_close):
     """ Image of an S2Eexi or of an S2Euni, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -82,8 +88,8 @@ def quantified_exp_image(node, key_image, open_close):
 
     """
     (key, image) = key_image  # `image` is a function.
-    for_type = image == type_image
     assert key == t.S2EXP_NODE or key == t.S2EXP_SRT
+    for_type = key == t.S2EXP_NODE
     (opn, close) = open_close  # Two paired characters.
     variables = node[0]
     predicats = node[1]
@@ -93,7 +99,7 @@ def quantified_exp_image(node, key_image, open_close):
     for variable in variables:
         if not first:
             result += "; "
-        result += s2var_image(variable[t.S2VAR_STAMP], for_type)
+        result += s2var_image(defs, variable[t.S2VAR_STAMP], for_type)
         first = False
     if predicats:
         if variables:
@@ -116,9 +122,9 @@ def quantified_exp_image(node, key_image, open_close):
 # Special cases
 # ----------------------------------------------------------------------------
 
-def s2var_image(stamp, for_type):
+def s2var_image(defs, stamp, for_type):
     """ Static variable image. """
-    den = declarations.get_def(t.S2VAR_STAMP, stamp)
+    den = declarations.get_def(defs, t.S2VAR_STAMP, stamp)
     if den is None:
         return "*ERROR*1*"
     result = ""
@@ -128,14 +134,14 @@ def s2var_image(stamp, for_type):
     return result
 
 
-def s2ecst_image(node, for_type):
+def s2ecst_image(defs, node, for_type):
     """ Image of a S2Ecst, either as type or sort.
 
     Type or sort, depending on `for_type`.
 
     """
     stamp = node[0][t.S2CST_STAMP]
-    den = declarations.get_def(t.S2CST_STAMP, stamp)
+    den = declarations.get_def(defs, t.S2CST_STAMP, stamp)
     if den is None:
         return "anonymous‑type"
     if for_type:
@@ -143,14 +149,14 @@ def s2ecst_image(node, for_type):
     return sort_image(den.sort)
 
 
-def s2evar_image(node, for_type):
+def s2evar_image(defs, node, for_type):
     """ Image of a S2Evar, either as type or sort.
 
     Type or sort, depending on `for_type`.
 
     """
     stamp = node[0][t.S2VAR_STAMP]
-    den = declarations.get_def(t.S2VAR_STAMP, stamp)
+    den = declarations.get_def(defs, t.S2VAR_STAMP, stamp)
     if den is None:
         return "*ERROR*3*"
     if for_type:
@@ -161,7 +167,7 @@ def s2evar_image(node, for_type):
 # Specific
 # ----------------------------------------------------------------------------
 
-def s2eapp_image(node, key_image, _paren_if_fun, paren_if_app):
+def s2eapp_image(_defs, node, key_image, _paren_if_fun, paren_if_app):
     """ Image of an S2Eapp, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -188,7 +194,7 @@ def s2eapp_image(node, key_image, _paren_if_fun, paren_if_app):
     return result
 
 
-def s2eexi_image(node, key_image, _paren_if_fun, _paren_if_app):
+def s2eexi_image(defs, node, key_image, _paren_if_fun, _paren_if_app):
     """ Image of an S2Eexi, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -196,10 +202,10 @@ def s2eexi_image(node, key_image, _paren_if_fun, _paren_if_app):
     Of an S2Eexi or of an S2Euni, depending on `open_close` characters.
 
     """
-    return quantified_exp_image(node, key_image, open_close=("[", "]"))
+    return quantified_exp_image(defs, node, key_image, open_close=("[", "]"))
 
 
-def s2efun_image(node, key_image, paren_if_fun, _paren_if_app):
+def s2efun_image(_defs, node, key_image, paren_if_fun, _paren_if_app):
     """ Image of a S2Efun, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -232,7 +238,7 @@ def s2efun_image(node, key_image, paren_if_fun, _paren_if_app):
     return result
 
 
-def s2erefarg_image(node, key_image, _paren_if_fun, _paren_if_app):
+def s2erefarg_image(_defs, node, key_image, _paren_if_fun, _paren_if_app):
     """ Image of a S2Erefarg, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -250,7 +256,7 @@ def s2erefarg_image(node, key_image, _paren_if_fun, _paren_if_app):
     return prefix + image(node[1][key], paren_if_fun=True, paren_if_app=True)
 
 
-def s2etop_image(node, key_image, _paren_if_fun, paren_if_app):
+def s2etop_image(_defs, node, key_image, _paren_if_fun, paren_if_app):
     """ Image of an S2Etop, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -275,7 +281,7 @@ def s2etop_image(node, key_image, _paren_if_fun, paren_if_app):
     return result
 
 
-def s2etyarr_image(node, key_image, _paren_if_fun, paren_if_app):
+def s2etyarr_image(_defs, node, key_image, _paren_if_fun, paren_if_app):
     """ Image of an S2Etyarr, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -304,7 +310,7 @@ def s2etyarr_image(node, key_image, _paren_if_fun, paren_if_app):
     return result
 
 
-def s2etyrec_image(node, key_image, _paren_if_fun, paren_if_app):
+def s2etyrec_image(_defs, node, key_image, _paren_if_fun, paren_if_app):
     """ Image of an S2Etyrec, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -345,7 +351,7 @@ def s2etyrec_image(node, key_image, _paren_if_fun, paren_if_app):
     return result
 
 
-def s2euni_image(node, key_image, _paren_if_fun, _paren_if_app):
+def s2euni_image(defs, node, key_image, _paren_if_fun, _paren_if_app):
     """ Image of an S2Euni, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -353,10 +359,10 @@ def s2euni_image(node, key_image, _paren_if_fun, _paren_if_app):
     Of an S2Eexi or of an S2Euni, depending on `open_close` characters.
 
     """
-    return quantified_exp_image(node, key_image, open_close=("{", "}"))
+    return quantified_exp_image(defs, node, key_image, open_close=("{", "}"))
 
 
-def s2ewthtype_image(node, key_image, _paren_if_fun, _paren_if_app):
+def s2ewthtype_image(_defs, node, key_image, _paren_if_fun, _paren_if_app):
     """ Image of an S2Ewthtype, either as type or sort.
 
     Type or sort, depending on `key_image`.
@@ -387,10 +393,15 @@ DISPATCH = {
 # Main
 # ============================================================================
 
-def s2e_image(node, for_type, paren_if_fun=False, paren_if_app=False):
+def s2e_image(
+        defs,
+        node,
+        for_type,
+        paren_if_fun=False,
+        paren_if_app=False):
     """ Image of s2exp_node, either as type or sort. """
     if for_type:
-        key_image = (t.S2EXP_NODE, type_image)
+        key_image = (t.S2EXP_NODE, functools.partial(type_image, defs))
     else:
         key_image = (t.S2EXP_SRT, sort_image)
 
@@ -400,9 +411,9 @@ def s2e_image(node, for_type, paren_if_fun=False, paren_if_app=False):
     sub_node = node[key]
 
     if key == t.S2ECST:
-        result = s2ecst_image(sub_node, for_type)
+        result = s2ecst_image(defs, sub_node, for_type)
     elif key == t.S2EVAR:
-        result = s2evar_image(sub_node, for_type)
+        result = s2evar_image(defs, sub_node, for_type)
     elif key == t.S2EEXTKIND:
         result = sub_node[0] if for_type else "?"
     elif key == t.S2EEXTYPE:
@@ -411,17 +422,22 @@ def s2e_image(node, for_type, paren_if_fun=False, paren_if_app=False):
         result = sub_node[0] if for_type else "?"
     elif key in DISPATCH:
         method = DISPATCH[key]
-        result = method(sub_node, key_image, paren_if_fun, paren_if_app)
+        result = method(
+            defs,
+            sub_node,
+            key_image,
+            paren_if_fun,
+            paren_if_app)
     else:
         result = "?"
     return result
 
 
-def type_image(node, paren_if_fun=False, paren_if_app=False):
+def type_image(defs, node, paren_if_fun=False, paren_if_app=False):
     """ Dyn image. """
-    return s2e_image(node, True, paren_if_fun, paren_if_app)
+    return s2e_image(defs, node, True, paren_if_fun, paren_if_app)
 
 
-def type_sorts_image(node, paren_if_fun=False, paren_if_app=False):
+def type_sorts_image(defs, node, paren_if_fun=False, paren_if_app=False):
     """ Dyn image. """
-    return s2e_image(node, False, paren_if_fun, paren_if_app)
+    return s2e_image(defs, node, False, paren_if_fun, paren_if_app)
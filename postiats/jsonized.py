@@ -3,16 +3,22 @@
 
 """ Cached JSONized ATS files retrieved as JSON objects.
 
-JSON data may also be returned to stdout, for use from the command line.
+The cache is managed from the command line with `cache`.
 
 """
 
+import collections
 import json
 import os
-import subprocess
-import sys
 
 from . import environment
+from . import locations
+from . import packing
+from . import tags as t
+
+# Modules only needed by some invocations, as `hashlib` and `subprocess`, are
+# imported by the functions using them, to keep the startup short when the
+# JSON data is retrieved from the cache. See `pats-benchmark startup`.
 
 # Cache directory
 # ============================================================================
@@ -40,39 +46,55 @@ CACHE_ROOT = (
 
 CACHE = os.path.join(CACHE_ROOT, "PostiATS")
 
-# Scanned directories for prefilling
+# Freshness of cache entries
+# ============================================================================
+
+# By default, a cache entry is fresh if it is newer than its source file.
+# With `CONTENT_KEYED`, a cache entry is instead keyed by a hash of its
+# source file content and of the `patsopt` version, so that it remains fresh
+# when modification times are reset, as by a checkout or a copy, as long as
+# the content is the same. The hash is recorded in the entry's meta file.
+#
+# Set the `POSTIATS_CONTENT_KEYED` environment variable to enable it.
+
+CONTENT_KEYED = bool(os.getenv("POSTIATS_CONTENT_KEYED"))
+
+# Cache format
+# ============================================================================
+
+# By default, a cache entry is the JSON text output by `patsopt`. With
+# `PACKED`, a cache entry is instead a ZIP archive with one compressed JSON
+# member per top-level section of the JSON object, so that a section can be
+# loaded without loading the others. See `get_json` and `packing`.
+#
+# Set the `POSTIATS_PACKED_CACHE` environment variable to enable it.
+
+PACKED = bool(os.getenv("POSTIATS_PACKED_CACHE"))
+
+# In-memory cache
 # ============================================================================
 
-ROOTS = [
-    environment.CWD,
-    environment.PATSHOME,
-    environment.PATSCONTRIB]
+# JSON objects retrieved by `get_json` are kept in memory, for the next
+# invocations in the same process. The least recently used ones are dropped
+# when there are more than `MEMORY_ENTRIES` or when their approximate size
+# is more than `MEMORY_BYTES`. Set `MEMORY_ENTRIES` to zero to disable it.
+
+MEMORY_ENTRIES = 64
+MEMORY_BYTES = 256 * 1024 * 1024
 
 # Other constants
 # ============================================================================
 
 JSON_EXT = ".json"
+META_EXT = ".meta"
+PACKED_EXT = ".pack"
+SPANS_EXT = ".spans"
+TEMPORARY_EXT = ".tmp"
 SATS_EXT = ".sats"
 DATS_EXT = ".dats"
 TIMEOUT_DELAY = 3
 POSTIATS_ENCODING = "iso-8859-15"
 
-HELP = """\
-Usage: %s -h|--help|--to-stdout file|--prefill|--purge|--directory
-
-Or else used as a Python3 module.
-
- * -h/--help: display this help.
- * --to-stdout file: for command line use, return the JSON object to stdout,
-   where file, is a SATS or DATS file.
- * --prefill: prefill the cache with ATS files from the distribution and
-   the current directory, recursively.
- * --purge: purge the cache directory, removing all JSON files and directories
-   left empty.
- * --directory: print the cache directory path.
-
-"""
-
 
 # Testing file types
 # ============================================================================
@@ -90,6 +112,33 @@ def is_json_file(file_name):
     return result
 
 
+def is_packed_file(file_name):
+    """ True if file extension is “.pack”. """
+    ext = file_ext(file_name)
+    result = ext == PACKED_EXT
+    return result
+
+
+def is_temporary_file(file_name):
+    """ True if `file_name` is hidden, with extension “.tmp”.
+
+    This is a file left by an interrupted `write_cache_file`.
+
+    """
+    ext = file_ext(file_name)
+    result = file_name.startswith(".") and ext == TEMPORARY_EXT
+    return result
+
+
+def is_cache_file(file_name):
+    """ True if file extension is “.json”, “.pack”, “.meta” or “.spans”, or
+    if it's a temporary file. """
+    ext = file_ext(file_name)
+    result = ext in [JSON_EXT, PACKED_EXT, META_EXT, SPANS_EXT]
+    result = result or is_temporary_file(file_name)
+    return result
+
+
 def is_sats_file(file_name):
     """ True if file extension is “.sats”. """
     ext = file_ext(file_name)
@@ -142,30 +191,6 @@ def clean_path(path):
     return resolved_path(path)
 
 
-# Scanning directories for prefilling
-# ============================================================================
-
-def files_from_root(root, accept):
-    """ Recursive list of files  in `root` for which `accept` is True. """
-    for (dir_path, _dir_names, file_names) in os.walk(root, followlinks=True):
-        for file_name in file_names:
-            if accept(file_name):
-                path = os.path.join(dir_path, file_name)
-                yield path
-
-
-def files_from_roots(roots, accept):
-    """ `files_from_root` for each non-None root in `roots`. """
-    for root in roots:
-        if root is not None:
-            yield from files_from_root(root, accept)
-
-
-def ats_files():
-    """ `files_from_roots(ROOTS, is_ats_file)`. """
-    yield from files_from_roots(ROOTS, is_ats_file)
-
-
 # Cached file names
 # ============================================================================
 
@@ -202,18 +227,54 @@ def get_cached_file_name(file_name):
     return result
 
 
+def get_packed_file_name(cached_file_name):
+    """ Packed file name for `cached_file_name`.
+
+    `foo-dats.json` is packed as `foo-dats.pack`.
+
+    """
+    return cached_file_name[:-len(JSON_EXT)] + PACKED_EXT
+
+
+def get_data_file_name(cached_file_name):
+    """ `cached_file_name` or its packed file name, depending on `PACKED`.
+    """
+    if PACKED:
+        return get_packed_file_name(cached_file_name)
+    return cached_file_name
+
+
+def get_meta_file_name(cached_file_name):
+    """ Meta file name for `cached_file_name`, with dependencies record.
+
+    `foo-dats.json` has its meta data in `foo-dats.json.meta`.
+
+    """
+    return cached_file_name + META_EXT
+
+
+def get_spans_file_name(cached_file_name):
+    """ Spans index file name for `cached_file_name`, see `nested_spans`.
+
+    `foo-dats.json` has its spans index in `foo-dats.json.spans`.
+
+    """
+    return cached_file_name + SPANS_EXT
+
+
 def get_source_file_name(json_name):
-    """ Source file name for cached `json_name`.
+    """ Source file name for cached `json_name`, JSON or packed.
 
     `file_name` is supposed to be a `clean_path`. The function can be invoked
     on non-`clean_path`, but it will not be relevant.
 
     """
-    assert json_name.endswith(JSON_EXT)
+    ext = file_ext(json_name)
+    assert ext in [JSON_EXT, PACKED_EXT]
     (directory, base_name) = os.path.split(json_name)
     new_directory = os.path.relpath(directory, start=CACHE)
     new_directory = os.path.join("/", new_directory)
-    new_base_name = base_name[:-len(JSON_EXT)]
+    new_base_name = base_name[:-len(ext)]
     i = new_base_name.rfind("-")
     if i != -1:
         new_base_name = new_base_name[:i] + "." + new_base_name[i + 1:]
@@ -233,6 +294,7 @@ def run(directory, command, encoding):
     string.
 
     """
+    import subprocess  # pylint: disable=import-outside-toplevel
     stdout = None
     stderr = None
     return_code = None
@@ -267,7 +329,7 @@ def run(directory, command, encoding):
     return result
 
 
-def make_cached_json(file_name):
+def make_cached_json(file_name, env=None):
     """ Invoke `patsopt --jsonize-2` on `file_name`.
 
     Backup the content in cache and return the content as a JSON object.
@@ -290,164 +352,620 @@ def make_cached_json(file_name):
         POSTIATS_ENCODING)
     if return_code == 0:
         cached_file_name = get_cached_file_name(path)
-        cached_directory = os.path.split(cached_file_name)[0]
-        if not os.path.exists(cached_directory):
-            os.makedirs(cached_directory)
-        output = open(cached_file_name, "w")
-        output.write(stdout)
-        output.close()
         result = json.loads(stdout)
+        meta = make_meta(path, result, env)
+        meta_file_name = get_meta_file_name(cached_file_name)
+        # The meta file is removed first and written last, so that a data
+        # file is never paired with the meta file of a previous one. A data
+        # file without a meta file is never fresh, see `is_fresh`.
+        try:
+            os.remove(meta_file_name)
+        except FileNotFoundError:
+            pass
+        if PACKED:
+            packed_file_name = get_packed_file_name(cached_file_name)
+            write_cache_file(packed_file_name, packing.packed(result))
+        else:
+            write_cache_file(cached_file_name, stdout)
+        write_cache_file(meta_file_name, json.dumps(meta))
     return result
 
 
-# Retrieving JSON
+def write_cache_file(cached_file_name, text):
+    """ Write `text` to `cached_file_name`, atomically.
+
+    `text` may be `str` or `bytes`.
+
+    The text is written to a temporary file in the same directory, which is
+    then renamed. Concurrent writers (as with `prefill_cache` using multiple
+    jobs) never leave a partially written file, and readers never see one.
+    The temporary file is removed on any failure, even an interruption, and
+    is created with the default permissions, as by `open`.
+
+    """
+    (cached_directory, base_name) = os.path.split(cached_file_name)
+    os.makedirs(cached_directory, exist_ok=True)
+    temporary_name = os.path.join(
+        cached_directory,
+        ".%s.%s%s" % (base_name, os.urandom(6).hex(), TEMPORARY_EXT))
+    handle = os.open(
+        temporary_name,
+        os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+        0o666)
+    written = False
+    try:
+        mode = "wb" if isinstance(text, bytes) else "w"
+        with os.fdopen(handle, mode) as output:
+            output.write(text)
+        os.replace(temporary_name, cached_file_name)
+        written = True
+    finally:
+        if not written:
+            os.remove(temporary_name)
+
+
+def only_sections(json_object, sections):
+    """ `json_object` with only `sections`, or all if `sections` is None.
+    """
+    if json_object is None or sections is None:
+        return json_object
+    result = {}
+    for (key, value) in json_object.items():
+        if key in sections:
+            result[key] = value
+    return result
+
+
+# Dependencies
 # ============================================================================
 
-def get_json_from_cache(file_name):
-    """ Try to get JSON from cache or else return None.
+# A cache entry has a meta file recording its dependencies, with a
+# fingerprint for each. The dependencies are the files staloaded or included
+# by the source file. The set is read from the JSON data itself, from the
+# `D2Cstaload` and `D2Cinclude` nodes. A `D2Cinclude` node does not tell the
+# included file name, which is retrieved from the locations of the included
+# declarations.
+#
+# The dependencies of the dependencies, are retrieved from the meta files of
+# their own cache entries, when there are some, so transitive dependencies
+# are known as soon as the dependencies are in the cache too.
+#
+# A dependency name is resolved as `patsopt` does, which is run in the
+# directory of the source file: first relative to this directory, then in
+# the search path. A name which can't be resolved is recorded as unresolved
+# in the meta file, and the cache entry is never fresh, as the file it
+# names may appear later.
+
+def fingerprint(path, current_stat):
+    """ `[mtime_ns, size]` of `path` or None if it can't be stat'ed.
+
+    `current_stat` is the `stat_key` of `path`. With `CONTENT_KEYED`, this
+    is `content_key(path)` instead.
 
-    Check the JSON file is newer than the ATS file, so even if the file
-    is in the cache, None may still be returned if the cache version is
-    outdated.
+    """
+    if CONTENT_KEYED:
+        return content_key(path, current_stat=current_stat)
+    result = None
+    if current_stat is not None:
+        result = [current_stat[2], current_stat[1]]
+    return result
 
-    `file_name` is assumed to be from `environment.which`.
+
+def dependency_path(file_name, directory, env=None):
+    """ `clean_path` of a dependency named `file_name` or None.
+
+    `directory` is that of the depending file, searched before the search
+    path of `env`.
 
     """
     result = None
-    path = clean_path(file_name)
-    cached_file_name = get_cached_file_name(path)
-    if os.path.exists(cached_file_name):
-        time = os.path.getmtime(path)
-        cached_time = os.path.getmtime(cached_file_name)
-        if cached_time > time:
-            try:
-                source = open(cached_file_name, "r")
-                try:
-                    result = json.load(source)
-                except ValueError:
-                    pass
-                source.close()
-            except OSError:
-                # Includes IOError
-                pass
+    path = os.path.join(directory, file_name)
+    if not os.path.isfile(path):
+        path = environment.which(file_name, env)
+    if path is not None:
+        result = clean_path(path)
     return result
 
 
-def get_json(file_name):
-    """ Get JSON for `file_name`, from cache or (re-)generated.
+def included_names(node):
+    """ Yield file names in locations of declarations in a D2Cinclude. """
+    for entry in node[1]:
+        loc = entry[t.D2ECL_LOC]
+        if locations.is_location(loc):
+            yield locations.parse(loc).path
 
-    Return `None` of not found.
 
-    Use `environment.which`.
+def dependency_names(node):
+    """ Yield staloaded and included file names in a JSON node. """
+    if isinstance(node, dict):
+        if t.D2CSTALOAD in node:
+            yield node[t.D2CSTALOAD][1]
+        if t.D2CINCLUDE in node:
+            yield from included_names(node[t.D2CINCLUDE])
+        for sub_node in node.values():
+            yield from dependency_names(sub_node)
+    elif isinstance(node, list):
+        for sub_node in node:
+            yield from dependency_names(sub_node)
+
+
+def direct_dependencies(path, json_object, env=None):
+    """ Dependencies of `path`, in `env`, as `(resolved, unresolved)`.
+
+    `resolved` is a set of `clean_path` and `unresolved` a set of the
+    dependency names which could not be resolved.
 
     """
+    resolved = set()
+    unresolved = set()
+    directory = os.path.dirname(path)
+    for name in set(dependency_names(json_object)):
+        dependency = dependency_path(name, directory, env)
+        if dependency is None:
+            unresolved.add(name)
+        elif dependency != path:
+            resolved.add(dependency)
+    result = (resolved, unresolved)
+    return result
+
+
+def read_meta(path):
+    """ Content of the meta file of the cache entry for `path`, or None. """
     result = None
-    path = environment.which(file_name)
-    if path is not None:
-        result = get_json_from_cache(path)
-        if result is None:
-            result = make_cached_json(path)
+    meta_file_name = get_meta_file_name(get_cached_file_name(path))
+    try:
+        source = open(meta_file_name, "r")
+        try:
+            result = json.load(source)
+        except ValueError:
+            pass
+        source.close()
+    except OSError:
+        # Includes IOError
+        pass
+    return result
+
+
+def recorded_dependencies(path):
+    """ Dependencies in the meta file for `path`, as a dictionary.
+
+    The dictionary maps dependency paths to their recorded fingerprint. It is
+    empty if there is no meta file.
+
+    """
+    meta = read_meta(path)
+    result = {}
+    if meta is not None:
+        result = meta["dependencies"]
+    return result
+
+
+def transitive_dependencies(path, dependencies):
+    """ `dependencies` of `path` completed with their own dependencies.
+
+    Return a dictionary mapping paths to fingerprints. The fingerprint of
+    a dependency which is not in `dependencies` is None: there is no record
+    of it from the cache entry of `path`.
+
+    """
+    result = {}
+    result.update(dependencies)
+    to_be_done = list(dependencies)
+    while to_be_done:
+        dependency = to_be_done.pop()
+        for sub_dependency in recorded_dependencies(dependency):
+            if sub_dependency not in result and sub_dependency != path:
+                result[sub_dependency] = None
+                to_be_done.append(sub_dependency)
+    return result
+
+
+def make_meta(path, json_object, env=None):
+    """ Meta data for the cache entry of `path`, from its JSON object.
+
+    With `CONTENT_KEYED`, it also holds the content key of `path` and the
+    stat key it was computed for.
+
+    """
+    (direct, unresolved) = direct_dependencies(path, json_object, env)
+    dependencies = transitive_dependencies(path, dict.fromkeys(direct))
+    for dependency in dependencies:
+        dependencies[dependency] = fingerprint(
+            dependency,
+            stat_key(dependency))
+    result = {"dependencies": dependencies}
+    if unresolved:
+        result["unresolved"] = sorted(unresolved)
+    if CONTENT_KEYED:
+        result["key"] = content_key(path)
+        result["stat"] = stat_key(path)
     return result
 
 
-def get_json_to_stdout(file_name):
-    """ Print JSON data for `file_name` to stdout.
+def dependency_keys(path, meta):
+    """ `stat_key` of the transitive dependencies of `path`, by path.
 
-    Useful to use the cache from the command line too, not only from Python
-    scripts importing this module.
+    The dependencies are those from `meta`, the meta data of the cache entry
+    for `path`, sorted.
 
     """
-    json_object = get_json(file_name)
-    if json_object is None:
-        print("Failed to evaluate %s" % file_name, file=sys.stderr)
-        sys.exit(1)
-    json.dump(json_object, sys.stdout)
-    print()
+    dependencies = memory_dependencies(path, meta)
+    result = {dependency: stat_key(dependency) for dependency in dependencies}
+    return result
+
+
+def dependencies_fresh(path, cached_time, meta, keys=None):
+    """ True if no dependency of `path` changed since it was cached.
 
+    A dependency with a recorded fingerprint changed, if its fingerprint is
+    not the same. A dependency without a recorded fingerprint changed, if it
+    was modified after `cached_time`. `meta` is the meta data of the cache
+    entry for `path`; without it, the dependencies are unknown, and the
+    result is False. With unresolved dependencies, the result is False too.
 
-# Prefilling, purging and listing
+    `keys` is the `dependency_keys` of `path` and `meta`, taken if None.
+
+    """
+    if meta is None or meta.get("unresolved"):
+        return False
+    if keys is None:
+        keys = dependency_keys(path, meta)
+    fingerprints = meta["dependencies"]
+    for (dependency, current_stat) in keys.items():
+        recorded = fingerprints.get(dependency)
+        if recorded is not None:
+            if fingerprint(dependency, current_stat) != recorded:
+                return False
+        elif current_stat is None or current_stat[2] > cached_time:
+            return False
+    return True
+
+
+# Content keys
 # ============================================================================
 
-def prefill_cache():
-    """ Cache jsonized ATS files from distribution and current directory. """
-    print("Prefilling cache.")
-    print("\rListing ATS files...", end="")
-    file_names = list(ats_files())
-    print("\rListing ATS files: done.")
-    index = 0
-    files_count = len(file_names)
-    cached_count = 0
-    for file_name in file_names:
-        index += 1
-        print("\rHandling ATS file #%i of %i" % (index, files_count), end="")
-        if get_json(file_name) is not None:
-            cached_count += 1
-    print("\nDone: %i file(s) cached." % cached_count)
-
-
-def purge_cache():
-    """ Purge cache deleting JSON files and directories left empty. """
-    for (dir_path, dir_names, file_names) in os.walk(CACHE, topdown=False):
-        for file_name in file_names:
-            if is_json_file(file_name):
-                path = os.path.join(dir_path, file_name)
-                print("Removing file “%s”" % path)
-                os.remove(path)
-        for directory in dir_names:
-            path = os.path.join(dir_path, directory)
-            if not os.listdir(path):
-                print("Removing directory “%s”" % path)
-                os.rmdir(path)
-
-
-def cached_files():
-    """ Yield cached JSON file names. """
-    for (dir_path, _dir_names, file_names) in os.walk(CACHE):
-        for file_name in file_names:
-            if is_json_file(file_name):
-                yield os.path.join(dir_path, file_name)
-
-
-def list_cached():
-    """ Yield tuple (json_name, source_name) for cached files. """
-    for json_name in cached_files():
-        source_name = get_source_file_name(json_name)
-        yield (json_name, source_name)
-
-
-# Main
+# The content key of a file is a hash of its bytes and of the `patsopt`
+# version. Hashing a file requires to read it, so keys are memoized for the
+# `stat_key` of the file, in this process and in the meta files of the cache
+# entries.
+
+CONTENT_KEYS = {}  # path -> (stat_key, content_key)
+
+PATSOPT_VERSION = None  # Set on first use of `patsopt_version`.
+
+
+def patsopt_version():
+    """ Output of `patsopt --version`, or the empty string on failure. """
+    global PATSOPT_VERSION
+    if PATSOPT_VERSION is None:
+        (stdout, _stderr, return_code) = run(
+            None,
+            ["patsopt", "--version"],
+            POSTIATS_ENCODING)
+        PATSOPT_VERSION = stdout.strip() if return_code == 0 else ""
+    return PATSOPT_VERSION
+
+
+def stat_key(path):
+    """ `[inode, size, mtime_ns]` of `path` or None if it can't be stat'ed.
+    """
+    result = None
+    try:
+        stat = os.stat(path)
+        result = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        pass
+    return result
+
+
+def hashed_content(path):
+    """ Content key of `path` computed from its bytes, or None. """
+    import hashlib  # pylint: disable=import-outside-toplevel
+    result = None
+    digest = hashlib.sha256()
+    digest.update(patsopt_version().encode(POSTIATS_ENCODING))
+    digest.update(b"\0")
+    try:
+        source = open(path, "rb")
+        digest.update(source.read())
+        source.close()
+        result = digest.hexdigest()
+    except OSError:
+        # Includes IOError
+        pass
+    return result
+
+
+def content_key(path, meta=None, current_stat=None):
+    """ Content key of `path`, or None if it can't be read.
+
+    The key is not recomputed if the stat key of `path` is the same as when
+    it was last computed, in this process or as recorded in `meta`, which
+    is the meta data of the cache entry for `path` (read if not given).
+    `current_stat` is the stat key of `path`, taken if not given.
+
+    """
+    if current_stat is None:
+        current_stat = stat_key(path)
+    if current_stat is None:
+        return None
+    if path in CONTENT_KEYS:
+        (memo_stat, memo_key) = CONTENT_KEYS[path]
+        if memo_stat == current_stat:
+            return memo_key
+    if meta is None:
+        meta = read_meta(path)
+    if meta is not None and meta.get("stat") == current_stat:
+        result = meta.get("key")
+    else:
+        result = hashed_content(path)
+    CONTENT_KEYS[path] = (current_stat, result)
+    return result
+
+
+def content_fresh(path, meta):
+    """ True if the cache entry for `path` has the content key of `path`.
+
+    `meta` is the meta data of the cache entry for `path`. When the key is
+    the same while the stat key is not (ex. after a checkout), the meta file
+    is updated with the new stat key, so that the next processes don't have
+    to hash the file again.
+
+    """
+    if meta is None or meta.get("key") is None:
+        return False
+    key = content_key(path, meta)
+    result = key == meta["key"]
+    current_stat = stat_key(path)
+    if result and meta.get("stat") != current_stat:
+        meta["stat"] = current_stat
+        meta_file_name = get_meta_file_name(get_cached_file_name(path))
+        try:
+            write_cache_file(meta_file_name, json.dumps(meta))
+        except OSError:
+            # Includes IOError. Not an issue, only the memo is lost.
+            pass
+    return result
+
+
+# In-memory cache
 # ============================================================================
 
-def main():
-
-    """ Main. """
-
-    my_name = os.path.split(sys.argv[0])[1]
-
-    arg_error = True
-
-    if len(sys.argv) == 2:
-        arg1 = sys.argv[1]
-        if arg1 in ["-h", "--help"]:
-            arg_error = False
-            print(HELP % my_name)
-        elif arg1 == "--prefill":
-            arg_error = False
-            prefill_cache()
-        elif arg1 == "--purge":
-            arg_error = False
-            purge_cache()
-        elif arg1 == "--directory":
-            arg_error = False
-            print("Cache directory: %s" % CACHE)
-    if len(sys.argv) == 3:
-        arg1 = sys.argv[1]
-        arg2 = sys.argv[2]
-        if arg1 == "--to-stdout":
-            arg_error = False
-            get_json_to_stdout(arg2)
-
-    if arg_error:
-        print("ERROR: Invalid argument(s).", file=sys.stderr)
-        print(HELP % my_name, file=sys.stderr)
-        sys.exit(1)
+# A JSON object in memory comes with the stamp of its cache entry, made of
+# the stat keys of the source file, of the cache data file and of each
+# dependency. As long as the stamp is the same, the JSON object in memory is
+# as fresh as when it was loaded. This check is cheaper than `is_fresh`,
+# which reads the meta files.
+
+class MemoryEntry:
+
+    """ JSON object in memory, with what is needed to check it's fresh. """
+
+    __slots__ = ["stamp", "dependencies", "json_object", "sections", "size"]
+
+    def __init__(self, stamp, dependencies, json_object, sections, size):
+        self.stamp = stamp
+        self.dependencies = dependencies  # List of dependency paths.
+        self.json_object = json_object
+        self.sections = sections  # Loaded sections, None if all are.
+        self.size = size  # Approximate size in bytes.
+
+
+MEMORY = collections.OrderedDict()  # path -> MemoryEntry, by recent use.
+MEMORY_SIZE = 0  # Total approximate size of `MEMORY` entries.
+
+
+def memory_stamp(path, data_file_name, dependencies):
+    """ Stamp of the cache entry for `path`, see `MemoryEntry`. """
+    result = [stat_key(path), stat_key(data_file_name)]
+    for dependency in dependencies:
+        result.append(stat_key(dependency))
+    return result
+
+
+def memory_dependencies(path, meta):
+    """ Sorted transitive dependencies of `path` from its `meta` data. """
+    result = []
+    if meta is not None:
+        dependencies = transitive_dependencies(path, meta["dependencies"])
+        result = sorted(dependencies)
+    return result
+
+
+def data_size(data_file_name, sections):
+    """ Approximate size in memory of `sections` of `data_file_name`.
+
+    This is the size of the JSON text, as a lower bound.
+
+    """
+    result = 0
+    if PACKED:
+        result = packing.unpacked_size(data_file_name, sections)
+    else:
+        try:
+            result = os.path.getsize(data_file_name)
+        except OSError:
+            # Includes IOError
+            pass
+    return result
+
+
+def memory_drop(path):
+    """ Remove `path` from `MEMORY`. """
+    global MEMORY_SIZE
+    entry = MEMORY.pop(path)
+    MEMORY_SIZE -= entry.size
+
+
+def memory_put(path, stamp, dependencies, json_object, sections):
+    """ Add `json_object` for `path` in `MEMORY`, dropping the oldest ones.
+
+    `sections` are the loaded sections of `json_object`, None if all are.
+
+    """
+    global MEMORY_SIZE
+    if MEMORY_ENTRIES <= 0:
+        return
+    if path in MEMORY:
+        memory_drop(path)
+    data_file_name = get_data_file_name(get_cached_file_name(path))
+    size = data_size(data_file_name, sections)
+    entry = MemoryEntry(stamp, dependencies, json_object, sections, size)
+    MEMORY[path] = entry
+    MEMORY_SIZE += size
+    while len(MEMORY) > 1 and (
+            len(MEMORY) > MEMORY_ENTRIES or MEMORY_SIZE > MEMORY_BYTES):
+        memory_drop(next(iter(MEMORY)))
+
+
+def memory_get(path, sections):
+    """ JSON object for `path` from `MEMORY`, or None.
+
+    If the JSON object in memory is outdated, it's removed and None is
+    returned. If some `sections` were not loaded, they are loaded first.
+
+    """
+    global MEMORY_SIZE
+    if path not in MEMORY:
+        return None
+    entry = MEMORY[path]
+    data_file_name = get_data_file_name(get_cached_file_name(path))
+    stamp = memory_stamp(path, data_file_name, entry.dependencies)
+    if stamp != entry.stamp:
+        memory_drop(path)
+        return None
+    if entry.sections is not None:
+        if sections is None:
+            missing = None
+        else:
+            missing = [key for key in sections if key not in entry.sections]
+        if missing is None or missing:
+            json_object = packing.unpacked(data_file_name, missing)
+            if json_object is None:
+                memory_drop(path)
+                return None
+            entry.json_object.update(json_object)
+            if missing is None:
+                entry.sections = None
+            else:
+                entry.sections = entry.sections + missing
+            size = data_size(data_file_name, entry.sections)
+            MEMORY_SIZE += size - entry.size
+            entry.size = size
+    MEMORY.move_to_end(path)
+    return entry.json_object
+
+
+# Retrieving JSON
+# ============================================================================
+
+def is_fresh(path, cached_file_name, meta=None, keys=None):
+    """ True if the cache entry `cached_file_name` for `path` is fresh.
+
+    Either by modification time or, with `CONTENT_KEYED`, by content key, and
+    with its dependencies unchanged.
+
+    `meta` is the meta data of the cache entry, read if None, and `keys` is
+    the `dependency_keys` of `path` and `meta`, taken if None. A caller
+    which already has them, does not have them read or taken twice.
+
+    """
+    try:
+        cached_time = os.stat(cached_file_name).st_mtime_ns
+    except FileNotFoundError:
+        return False  # Removed meanwhile, as by a concurrent writer.
+    if meta is None:
+        meta = read_meta(path)
+    if CONTENT_KEYED:
+        result = content_fresh(path, meta)
+    else:
+        time = os.stat(path).st_mtime_ns
+        result = cached_time > time
+    result = result and dependencies_fresh(path, cached_time, meta, keys)
+    return result
+
+
+def get_json_from_cache(file_name, sections=None):
+    """ Try to get JSON from cache or else return None.
+
+    Check the JSON file is newer than the ATS file and than the files it
+    depends on, so even if the file is in the cache, None may still be
+    returned if the cache version is outdated. See `is_fresh`.
+
+    With `PACKED`, only the top-level `sections` are loaded, if not None.
+
+    The JSON object is first looked up in memory, see `MEMORY`. It is shared
+    with the other callers and must not be modified.
+
+    `file_name` is assumed to be from `environment.which`.
+
+    """
+    path = clean_path(file_name)
+    result = memory_get(path, sections)
+    if result is not None:
+        return result
+    cached_file_name = get_cached_file_name(path)
+    data_file_name = get_data_file_name(cached_file_name)
+    if os.path.exists(data_file_name):
+        meta = read_meta(path)
+        dependencies = memory_dependencies(path, meta)
+        stamp = memory_stamp(path, data_file_name, dependencies)
+        keys = dict(zip(dependencies, stamp[2:]))
+        # The stamp is taken before the freshness check, so that a change
+        # in between, makes it outdated. The freshness check uses the same
+        # stat keys of the dependencies.
+        if is_fresh(path, data_file_name, meta, keys):
+            if PACKED:
+                result = packing.unpacked(data_file_name, sections)
+            else:
+                sections = None  # All are loaded.
+                try:
+                    source = open(data_file_name, "r")
+                    try:
+                        result = json.load(source)
+                    except ValueError:
+                        pass
+                    source.close()
+                except OSError:
+                    # Includes IOError
+                    pass
+        if result is not None:
+            memory_put(path, stamp, dependencies, result, sections)
+    return result
+
+
+def get_json(file_name, sections=None, env=None):
+    """ Get JSON for `file_name`, from cache or (re-)generated.
+
+    Return `None` of not found.
+
+    If `sections` is not None, it's a list of the top-level keys the caller
+    needs, and only these ones are in the result. With `PACKED`, the other
+    ones are not even loaded from the cache.
+
+    The result may be shared with other callers and must not be modified.
+
+    Use `environment.which`, with `env` defaulting to the current
+    environment.
+
+    """
+    result = None
+    path = environment.which(file_name, env)
+    if path is not None:
+        result = get_json_from_cache(path, sections)
+        if result is None:
+            # The stat key of the source file is taken before generating, so
+            # that a change while generating makes the memory entry outdated.
+            source_stat = stat_key(path)
+            result = make_cached_json(path, env)
+            if result is not None:
+                path = clean_path(path)
+                data_file_name = get_data_file_name(get_cached_file_name(path))
+                meta = read_meta(path)
+                if meta is not None and not meta.get("unresolved"):
+                    # Never fresh otherwise, see `dependencies_fresh`.
+                    dependencies = memory_dependencies(path, meta)
+                    stamp = memory_stamp(path, data_file_name, dependencies)
+                    stamp[0] = source_stat
+                    memory_put(path, stamp, dependencies, result, None)
+    return only_sections(result, sections)
@@ -1,10 +1,22 @@
 """ Lexicalisation of ATS2 sources. """
 
+import array
+import mmap
+import os
+
 from . import lexemes_defs as d
 
 from .lexemes_defs import (Fin, NonFin, Start)
 
 
+# Constants
+# ============================================================================
+
+ENCODING = "iso-8859-15"
+
+CHARS = bytes(range(256)).decode(ENCODING)  # Characters by byte.
+
+
 # Types
 # ============================================================================
 
@@ -37,7 +49,7 @@ class Input:
         """ String from start to pos excluded. """
         if end is None:
             end = self.pos
-        return self.source[start:self.pos]
+        return self.source[start:end]
 
     def at(self, text):
         """ True if string at current position. """
@@ -46,14 +58,68 @@ class Input:
         return self.source[i:j] == text
 
 
+class MappedInput(Input):
+
+    """ Input bytes in `ENCODING`, as from a file mapped in memory.
+
+    As `ENCODING` is single-byte, positions are the same as in the decoded
+    text. Only the characters read and the strings requested are decoded.
+    Unlike with `file_input`, newlines are not translated, so positions are
+    byte offsets, as in `patsopt` locations, even with CR-LF newlines.
+
+    """
+
+    __slots__ = []
+
+    def char(self, offset=0):
+        """ Character at pos or EOF is at end of string. """
+        i = self.pos + offset
+        if i < self.length:
+            return CHARS[self.source[i]]
+        if i == self.length:
+            return d.EOF
+        raise ValueError
+
+    def string(self, start, end=None):
+        """ String from start to pos excluded. """
+        if end is None:
+            end = self.pos
+        return self.source[start:end].decode(ENCODING)
+
+    def at(self, text):
+        """ True if string at current position. """
+        i = self.pos
+        j = i + len(text)
+        return self.source[i:j] == text.encode(ENCODING)
+
+    def close(self):
+        """ Unmap the file, if mapped. """
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+
 def file_input(path):
     """ Input from file. """
-    source_file = open(path, encoding="iso-8859-15")
+    source_file = open(path, encoding=ENCODING)
     source_text = source_file.read()
     source_file.close()
     return Input(source_text)
 
 
+def mapped_input(path):
+    """ `MappedInput` from file, to be closed after use. """
+    source_file = open(path, "rb")
+    if os.fstat(source_file.fileno()).st_size == 0:
+        source_bytes = b""  # An empty file can't be mapped.
+    else:
+        source_bytes = mmap.mmap(
+            source_file.fileno(),
+            0,
+            access=mmap.ACCESS_READ)
+    source_file.close()
+    return MappedInput(source_bytes)
+
+
 # Helpers
 # ============================================================================
 
@@ -635,10 +701,10 @@ def string(source, _in_feffs):
         elif c == '"':
             source.consume()
             break
+        elif c == d.EOF:
+            return Fin.T_ERR
         else:
             source.consume()
-        if c == d.EOF:
-            return Fin.T_ERR
     return Fin.T_STRING
 
 
@@ -750,16 +816,25 @@ def check_in_feffs(product, in_feffs):
     return product in {Fin.T_EQLT, Fin.T_MINUSLT, Fin.T_COLONLT}
 
 
-def raw(source):
-    """ Unfiltered lexemes. """
+def raw(source, in_feffs=False, sol=True, texts=True):
+    """ Unfiltered lexemes.
+
+    `in_feffs` and `sol` are the state at `source.pos`, for a restart after
+    a lexeme other than T_SPACE: `sol` is then False, and `in_feffs` is
+    `check_in_feffs` of the lexemes before.
+
+    If `texts` is False, the text of the lexemes is None, to be read from
+    `source` when needed, as `token_table` does.
+
+    """
 
     def fin(kind):
         """ (pos, kind, string) """
         assert isinstance(kind, Fin)
-        return (kind, pos, source.pos, source.string(pos))
+        if texts:
+            return (kind, pos, source.pos, source.string(pos))
+        return (kind, pos, source.pos, None)
 
-    in_feffs = False
-    sol = True
     while True:
         pos = source.pos
         space = get_space(source)
@@ -826,3 +901,88 @@ def filtered(source):
             yield lexeme
         else:
             yield lexeme
+
+
+# Token table
+# ============================================================================
+
+KINDS = list(Fin)
+KIND_INDEXES = {kind: index for (index, kind) in enumerate(KINDS)}
+
+assert len(KINDS) <= 256  # Kind indexes are bytes.
+
+
+class TokenTable:
+
+    """ Lexemes stored as columns, with their text read from the source.
+
+    The columns are arrays of the kind indexes in `KINDS`, of the start
+    positions and of the end positions. A lexeme as a tuple, the same as
+    from `raw`, is made only when requested, its text being the `string` of
+    `source`, an `Input`.
+
+    """
+
+    __slots__ = ["source", "kinds", "starts", "ends"]
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array.array("B")
+        self.starts = array.array("i")
+        self.ends = array.array("i")
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        start = self.starts[index]
+        end = self.ends[index]
+        text = self.source.string(start, end)
+        result = (KINDS[self.kinds[index]], start, end, text)
+        return result
+
+    def __iter__(self):
+        return table_lexemes(self)
+
+    def append(self, lexeme):
+        """ Append `lexeme`, a tuple as from `raw`. """
+        self.kinds.append(KIND_INDEXES[lexeme[0]])
+        self.starts.append(lexeme[1])
+        self.ends.append(lexeme[2])
+
+    def kind(self, index):
+        """ Kind of the lexeme at `index`. """
+        return KINDS[self.kinds[index]]
+
+    def text(self, index):
+        """ Text of the lexeme at `index`. """
+        return self.source.string(self.starts[index], self.ends[index])
+
+
+def token_table(source, lexer=None):
+    """ `TokenTable` of the lexemes of `source`, an `Input`, from `lexer`.
+
+    `lexer` defaults to `raw` without texts, so with a `MappedInput`, only
+    the texts requested from the table are decoded.
+
+    """
+    result = TokenTable(source)
+    kinds = result.kinds
+    starts = result.starts
+    ends = result.ends
+    if lexer is None:
+        produced = raw(source, texts=False)
+    else:
+        produced = lexer(source)
+    for (kind, start, end, _text) in produced:
+        kinds.append(KIND_INDEXES[kind])
+        starts.append(start)
+        ends.append(end)
+    return result
+
+
+def table_lexemes(table):
+    """ Lexemes of `table`, as tuples the same as from `raw`. """
+    source = table.source
+    for (kind_index, start, end) in zip(table.kinds, table.starts, table.ends):
+        yield (KINDS[kind_index], start, end, source.string(start, end))
@@ -0,0 +1,503 @@
+""" Lexicalisation of ATS2 sources, with compiled patterns.
+
+This is another engine for `lexemes.raw`, yielding the same lexemes. The
+character categories of `lexemes_defs` are compiled into regular
+expressions, so that runs of characters are read at once, and the prefix
+tree `lexemes_defs.TREE` is compiled into a table from first character to
+prefixes, longest first, with their final product or their handler.
+Non-finals are translated once for all, and products are compared by
+identity, as hashing an `Enum` member is costly.
+
+"""
+
+import re
+
+from . import lexemes
+from . import lexemes_defs as d
+
+from .lexemes_defs import (Fin, NonFin, Start)
+
+
+# Compilation
+# ============================================================================
+
+# Character categories
+# ----------------------------------------------------------------------------
+
+def category(chars):
+    """ Regular expression of a character of the set `chars`. """
+    return "[" + "".join(re.escape(c) for c in sorted(chars)) + "]"
+
+
+SPACE = category(d.SPACE)
+OCTAL = category(d.OCTAL)
+DIGIT = category(d.DIGIT)
+XDIGIT = category(d.XDIGIT)
+IDENTFST = category(d.IDENTFST)
+IDENTRST = category(d.IDENTRST)
+SYMBOLIC = category(d.SYMBOLIC)
+
+SPACES_RE = re.compile(SPACE + "+")
+OCTALS_RE = re.compile(OCTAL + "*")
+OCTAL3_RE = re.compile(OCTAL + "{0,3}")
+DIGITS_RE = re.compile(DIGIT + "*")
+XDIGITS_RE = re.compile(XDIGIT + "*")
+XDIGIT2_RE = re.compile(XDIGIT + "{0,2}")
+IDENT_RE = re.compile(IDENTFST + IDENTRST + "*")
+SYMBOLS_RE = re.compile(SYMBOLIC + "+")
+STRING_CHARS_RE = re.compile(r'[^"\\]*')
+COMMENT_BLOCK_ML_RE = re.compile(r"\(\*|\*\)")
+
+
+# Prefixes
+# ----------------------------------------------------------------------------
+
+def tree_prefixes(node, prefix=""):
+    """ Yield `(prefix, product)` for each product in the tree at `node`.
+
+    A Fin or NonFin product is only followed by products in the tree, so
+    that walking the tree never goes further than the longest prefix with
+    a product, except with a Start product, which restarts at the prefix.
+    This is what makes `get_prefix_product` the same as a longest prefix
+    lookup.
+
+    """
+    if node.product is not None:
+        if not isinstance(node.product, Start):
+            assert all(
+                child.product is not None
+                for child in node.next.values())
+        yield (prefix, node.product)
+    for (c, child) in node.next.items():
+        yield from tree_prefixes(child, prefix + c)
+
+
+def final(product):
+    """ `product` with a NonFin translated, as by `lexemes.raw`. """
+    if isinstance(product, NonFin):
+        return d.NONFINS_TRANSL[product]
+    return product
+
+
+def prefixes_table(tree, dispatch):
+    """ Dictionary of `(prefix, product, handler)` lists by first character.
+
+    Lists are ordered by decreasing prefix length. `EOF` is not included.
+    For a Start product, `product` is None and `handler` is from `dispatch`,
+    otherwise `product` is final and `handler` is None.
+
+    """
+    result = {}
+    for (prefix, product) in tree_prefixes(tree):
+        if prefix == d.EOF:
+            continue
+        if isinstance(product, Start):
+            entry = (prefix, None, dispatch[product])
+        else:
+            entry = (prefix, final(product), None)
+        result.setdefault(prefix[0], []).append(entry)
+    for prefixes in result.values():
+        prefixes.sort(key=lambda entry: len(entry[0]), reverse=True)
+    return result
+
+
+def ident_key_breaks(tree):
+    """ Characters ending the identifier part of prefixes starting with an
+    identifier, as “@” in “t@ype”.
+
+    An identifier is not the prefix of one of these prefixes, unless it is
+    followed by one of these characters.
+
+    """
+    result = set()
+    for (prefix, _product) in tree_prefixes(tree):
+        if len(prefix) > 1 and prefix[0] in d.IDENTFST:
+            rest = [c for c in prefix if c not in d.IDENTRST]
+            assert rest  # Otherwise, it would be an identifier.
+            result.add(rest[0])
+    return result
+
+
+# Translations
+# ----------------------------------------------------------------------------
+
+IDENTS = {
+    ident: final(product)
+    for (ident, product) in d.IDENTS_TRANSL.items()}
+
+COMMENT_BLOCK_C = final(NonFin.COMMENT_block_c)
+COMMENT_BLOCK_ML = final(NonFin.COMMENT_block_ml)
+
+
+def translation(name, default, in_feffs):
+    """ Final `lexemes_defs.ident_translation`. """
+    if in_feffs:
+        if default is Fin.T_IDENT_sym and name == ">":
+            return Fin.T_GT_OR_IDENT
+        return default
+    return IDENTS.get(name, default)
+
+
+# Helpers
+# ============================================================================
+
+def exponent(text, pos, marks, digits_re):
+    """ `(end, ok)` for `(marks SIGN? digits+)?` at `pos` in `text`.
+
+    `ok` is False if there is a mark without digits, in which case `end` is
+    after the mark and sign.
+
+    """
+    end = pos
+    ok = True
+    if end < len(text) and text[end] in marks:
+        end += 1
+        if end < len(text) and text[end] in d.SIGN:
+            end += 1
+        digits_end = digits_re.match(text, end).end()
+        ok = digits_end > end
+        if ok:
+            end = digits_end
+    return (end, ok)
+
+
+def optional(text, pos, chars):
+    """ Position after `chars?` at `pos` in `text`. """
+    if pos < len(text) and text[pos] in chars:
+        return pos + 1
+    return pos
+
+
+# Specials
+# ============================================================================
+
+def space_float_dec(text, pos):
+    """ `(product, end)` for T_FLOAT, see `lexemes.space_float_dec`. """
+    end = DIGITS_RE.match(text, pos + 1).end()
+    (end, ok) = exponent(text, end, d.E, DIGITS_RE)
+    if not ok:
+        return (Fin.T_ERR, end)
+    return (Fin.T_FLOAT, optional(text, end, d.FL))
+
+
+def extcode(text, pos):
+    """ `(product, end)` for T_EXTCODE, see `lexemes.extcode`. """
+    end_string = d.EOL + "%}"
+    end = text.find(end_string, pos)
+    if end == -1:
+        return (Fin.T_ERR, len(text))
+    return (Fin.T_EXTCODE, end + len(end_string))
+
+
+# Prefix handlers
+# ============================================================================
+
+# Each handler returns `(product, end)` for a lexeme at `pos` in `text`, as
+# the handler of the same name in `lexemes`.
+
+def char(text, pos, _in_feffs):
+    """ T_CHAR """
+    end = pos + 1
+    length = len(text)
+    if end < length and text[end] == "\\":
+        end += 1
+        c = text[end] if end < length else d.EOF
+        if c in d.ESCAPED:
+            end += 1
+        elif c == "0" and end + 1 < length and text[end + 1] in d.X:
+            end += 2
+            digits_end = XDIGITS_RE.match(text, end).end()
+            if digits_end == end:
+                return (Fin.T_ERR, end)
+            end = digits_end
+        elif c in d.OCTAL:
+            end = OCTALS_RE.match(text, end).end()
+        else:
+            return (Fin.T_ERR, end)
+    else:
+        if end == length:
+            return (Fin.T_ERR, end)
+        end += 1
+    if end < length and text[end] == "'":
+        return (Fin.T_CHAR, end + 1)
+    return (Fin.T_ERR, end)
+
+
+def comment_block_c(text, pos, _in_feffs):
+    """ COMMENT_block_c """
+    end = text.find("*/", pos)
+    if end == -1:
+        return (Fin.T_ERR, len(text))
+    return (COMMENT_BLOCK_C, end + 2)
+
+
+def comment_block_ml(text, pos, _in_feffs):
+    """ COMMENT_block_ml """
+    level = 0
+    for match in COMMENT_BLOCK_ML_RE.finditer(text, pos):
+        if match.group() == "(*":
+            level += 1
+        else:
+            level -= 1
+            if level == 0:
+                return (COMMENT_BLOCK_ML, match.end())
+    return (Fin.T_ERR, len(text))
+
+
+def comment_line(text, pos, _in_feffs):
+    """ T_COMMENT_line """
+    end = text.find(d.EOL, pos)
+    if end == -1:
+        end = len(text)
+    return (Fin.T_COMMENT_line, end)
+
+
+def comment_rest(text, _pos, _in_feffs):
+    """ T_COMMENT_rest """
+    return (Fin.T_COMMENT_rest, len(text))
+
+
+def dotint(text, pos, _in_feffs):
+    """ T_DOTINT """
+    return (Fin.T_DOTINT, DIGITS_RE.match(text, pos + 1).end())
+
+
+def float_dec(text, pos, _in_feffs):
+    """ T_FLOAT """
+    end = pos + 1
+    if text[end] == ".":
+        end = DIGITS_RE.match(text, end + 1).end()
+    (end, ok) = exponent(text, end, d.E, DIGITS_RE)
+    if not ok:
+        return (Fin.T_ERR, end)
+    return (Fin.T_FLOAT, optional(text, end, d.FL))
+
+
+def ident_dlr(text, pos, in_feffs):
+    """ T_IDENT_dlr """
+    end = IDENT_RE.match(text, pos + 1).end()
+    product = translation(text[pos:end], Fin.T_IDENT_dlr, in_feffs)
+    return (product, end)
+
+
+def ident_srp(text, pos, in_feffs):
+    """ T_IDENT_srp """
+    end = IDENT_RE.match(text, pos + 1).end()
+    product = translation(text[pos:end], Fin.T_IDENT_srp, in_feffs)
+    return (product, end)
+
+
+def ident_sym(text, pos, in_feffs):
+    """ T_IDENT_sym """
+    end = pos
+    if text[end] == "$":
+        end += 1
+    end = SYMBOLS_RE.match(text, end).end()
+    product = translation(text[pos:end], Fin.T_IDENT_sym, in_feffs)
+    return (product, end)
+
+
+IDENT_XX_SUFFIXES = {
+    "[": Fin.T_IDENT_arr,
+    "!": Fin.T_IDENT_ext,
+    "<": Fin.T_IDENT_tmp}
+
+
+def ident_xx(text, pos, in_feffs):
+    """ T_IDENT_arr, T_IDENT_ext, T_IDENT_tmp, T_IDENT_alp """
+    end = IDENT_RE.match(text, pos).end()
+    if end < len(text) and text[end] in IDENT_XX_SUFFIXES:
+        return (IDENT_XX_SUFFIXES[text[end]], end + 1)
+    product = translation(text[pos:end], Fin.T_IDENT_alp, in_feffs)
+    return (product, end)
+
+
+def int_oct(text, pos, _in_feffs):
+    """ T_INT """
+    end = OCTALS_RE.match(text, pos).end()
+    return (Fin.T_INT, optional(text, end, d.LU))
+
+
+def qmarkgt(_text, pos, in_feffs):
+    """ T_IDENT_sym """
+    product = translation("?", Fin.T_IDENT_sym, in_feffs)
+    return (product, pos + 1)
+
+
+def string(text, pos, _in_feffs):
+    """ T_STRING """
+    end = pos + 1
+    length = len(text)
+    while True:
+        end = STRING_CHARS_RE.match(text, end).end()
+        if end == length:
+            return (Fin.T_ERR, end)
+        if text[end] == '"':
+            return (Fin.T_STRING, end + 1)
+        # A backslash.
+        end += 1
+        c = text[end] if end < length else d.EOF
+        if c in d.ESCAPED or c == "\n":
+            end += 1
+        elif c == "0" and end + 1 < length and text[end + 1] in d.X:
+            end += 2
+            digits_end = XDIGIT2_RE.match(text, end).end()
+            if digits_end == end:
+                return (Fin.T_ERR, end)
+            end = digits_end
+        elif c in d.OCTAL:
+            end = OCTAL3_RE.match(text, end).end()
+        else:
+            return (Fin.T_ERR, end)
+
+
+def xx_dec(text, pos, _in_feffs):
+    """ T_FLOAT, T_INT """
+    end = DIGITS_RE.match(text, pos).end()
+    a_float = False
+    if end < len(text) and text[end] == ".":
+        a_float = True
+        end = DIGITS_RE.match(text, end + 1).end()
+    if end < len(text) and text[end] in d.E:
+        a_float = True
+        (end, ok) = exponent(text, end, d.E, DIGITS_RE)
+        if not ok:
+            return (Fin.T_ERR, end)
+    if a_float:
+        return (Fin.T_FLOAT, optional(text, end, d.FL))
+    return (Fin.T_INT, optional(text, end, d.LU))
+
+
+def xx_hex(text, pos, _in_feffs):
+    """ T_FLOAT, T_INT """
+    start = pos + 2
+    end = XDIGITS_RE.match(text, start).end()
+    integral = end > start
+    fractional = False
+    a_float = False
+    if end < len(text) and text[end] == ".":
+        a_float = True
+        start = end + 1
+        end = XDIGITS_RE.match(text, start).end()
+        fractional = end > start
+    if end < len(text) and text[end] in d.P:
+        a_float = True
+        (end, ok) = exponent(text, end, d.P, XDIGITS_RE)
+        if not ok:
+            return (Fin.T_ERR, end)
+    elif a_float:
+        return (Fin.T_ERR, end)
+    if a_float:
+        if not integral and not fractional:
+            return (Fin.T_ERR, end)
+        return (Fin.T_FLOAT, optional(text, end, d.FL))
+    if not integral:
+        return (Fin.T_ERR, end)
+    return (Fin.T_INT, optional(text, end, d.LU))
+
+
+# Dispatch
+# ----------------------------------------------------------------------------
+
+# The handlers have the names of those of `lexemes.DISPATCH`.
+DISPATCH = {
+    start: globals()[handler.__name__]
+    for (start, handler) in lexemes.DISPATCH.items()}
+
+assert set(DISPATCH) == set(Start)
+
+
+# Main
+# ============================================================================
+
+# Tables
+# ----------------------------------------------------------------------------
+
+PREFIXES = prefixes_table(d.TREE, DISPATCH)
+
+IDENT_KEY_BREAKS = ident_key_breaks(d.TREE)
+
+
+# Lexemes
+# ----------------------------------------------------------------------------
+
+def ident(text, pos, in_feffs):
+    """ `(product, end)` for a lexeme starting with `IDENTFST`.
+
+    This is `ident_xx`, unless there is a longer prefix, as “t@ype”.
+
+    """
+    end = IDENT_RE.match(text, pos).end()
+    if end < len(text) and text[end] in IDENT_KEY_BREAKS:
+        for (prefix, product, handler) in PREFIXES[text[pos]]:
+            if text.startswith(prefix, pos):
+                if handler is None:
+                    return (product, pos + len(prefix))
+                break
+    if end < len(text) and text[end] in IDENT_XX_SUFFIXES:
+        return (IDENT_XX_SUFFIXES[text[end]], end + 1)
+    product = translation(text[pos:end], Fin.T_IDENT_alp, in_feffs)
+    return (product, end)
+
+
+def raw(source, in_feffs=False, sol=True):
+    """ Unfiltered lexemes, the same as `lexemes.raw(source, in_feffs, sol)`.
+
+    `source` is a `lexemes.Input`. As with `lexemes.raw`, an `EOF`
+    character is the end of the source, even if it is not at its end.
+
+    """
+    text = source.source
+    eof = text.find(d.EOF, source.pos)
+    if eof != -1:
+        text = text[:eof]
+    length = len(text)
+    pos = source.pos
+    while True:
+        if pos == length:
+            yield (Fin.T_EOF, pos, pos, "")
+            break
+        c = text[pos]
+        space = False
+        if c in d.SPACE:
+            end = SPACES_RE.match(text, pos).end()
+            sol = text[end - 1] == d.EOL
+            source.pos = end
+            yield (Fin.T_SPACE, pos, end, text[pos:end])
+            pos = end
+            space = True
+            if pos == length:
+                yield (Fin.T_EOF, pos, pos, "")
+                break
+            c = text[pos]
+        if c in d.IDENTFST:
+            (product, end) = ident(text, pos, in_feffs)
+        elif (space and
+              c == "." and
+              pos + 1 < length and
+              text[pos + 1] in d.DIGIT):
+            (product, end) = space_float_dec(text, pos)
+        elif sol and c == "%" and text.startswith("%{", pos):
+            (product, end) = extcode(text, pos)
+        else:
+            product = Fin.T_ERR
+            end = pos + 1
+            for (prefix, prefix_product, handler) in PREFIXES.get(c, ()):
+                if text.startswith(prefix, pos):
+                    if handler is None:
+                        product = prefix_product
+                        end = pos + len(prefix)
+                    else:
+                        (product, end) = handler(text, pos, in_feffs)
+                    break
+        source.pos = end
+        yield (product, pos, end, text[pos:end])
+        pos = end
+        if in_feffs:
+            in_feffs = product is not Fin.T_GT_OR_IDENT
+        else:
+            in_feffs = (
+                product is Fin.T_EQLT or
+                product is Fin.T_MINUSLT or
+                product is Fin.T_COLONLT)
+        sol = False
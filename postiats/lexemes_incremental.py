@@ -0,0 +1,165 @@
+""" Incremental relexing of ATS2 sources, as edited in an editor buffer.
+
+After an edit of a text, only the lexemes around the edit are lexed again.
+Lexing restarts at the start of an iteration of `lexemes.raw` before the
+edit, which the edit cannot change, and stops as soon as it is again at the
+start of an iteration, after the edit, at the same place and in the same
+state as the previous lexing. Lexemes from there on are the previous ones,
+moved by the difference in length.
+
+The state of `lexemes.raw` at the start of an iteration is `sol`, which is
+False except at the start of the text, and `in_feffs`, which depends on the
+lexemes before. Multi-line lexemes, as `comment_block_ml` and `extcode`,
+need no special care: a lexeme is never a place to restart or to stop at.
+
+"""
+
+import collections
+
+from . import lexemes
+from . import lexemes_compiled
+
+from .lexemes_defs import Fin
+
+# Constants
+# ============================================================================
+
+# How far a lexeme may depend on the characters after its end. This is more
+# than the lexers look ahead: they look ahead by at most the length of a
+# prefix and one character.
+
+LOOKAHEAD = max(
+    len(entry[0])
+    for entries in lexemes_compiled.PREFIXES.values()
+    for entry in entries) + 1
+
+IN_FEFFS_STARTS = {Fin.T_EQLT, Fin.T_MINUSLT, Fin.T_COLONLT}
+
+# `lexemes[start:stop]` were replaced with `lexemes[start:start + count]`.
+Relexing = collections.namedtuple(
+    "Relexing",
+    ["text", "lexemes", "start", "stop", "count"])
+
+
+# Helpers
+# ============================================================================
+
+def is_iteration_start(lexemes_list, index):
+    """ True if `lexemes_list[index]` starts an iteration of `lexemes.raw`.
+
+    An iteration yields an optional T_SPACE and another lexeme.
+
+    """
+    result = index == 0 or lexemes_list[index - 1][0] != Fin.T_SPACE
+    return result
+
+
+def in_feffs_before(lexemes_list, index):
+    """ `in_feffs` of `lexemes.raw` before `lexemes_list[index]`.
+
+    T_GT_OR_IDENT, which ends an `in_feffs` state, is only lexed in such a
+    state, so it's given by the last of it and of the starts of such a
+    state.
+
+    """
+    result = False
+    while index > 0:
+        index -= 1
+        kind = lexemes_list[index][0]
+        if kind in IN_FEFFS_STARTS:
+            result = True
+            break
+        if kind == Fin.T_GT_OR_IDENT:
+            break
+    return result
+
+
+def restart_index(lexemes_list, offset):
+    """ Index of the last lexeme to restart at, for an edit at `offset`.
+
+    It starts an iteration and the lexemes before end far enough before
+    `offset`, to not depend on the edit.
+
+    """
+    low = 0
+    high = len(lexemes_list) - 1  # At worst, restart at the T_EOF.
+    while low < high:  # Lexemes ends are in order.
+        middle = (low + high) // 2
+        if lexemes_list[middle][2] + LOOKAHEAD > offset:
+            high = middle
+        else:
+            low = middle + 1
+    result = low
+    while result > 0 and not is_iteration_start(lexemes_list, result):
+        result -= 1
+    return result
+
+
+def moved(lexeme, delta):
+    """ `lexeme` moved by `delta` characters. """
+    result = (lexeme[0], lexeme[1] + delta, lexeme[2] + delta, lexeme[3])
+    return result
+
+
+# Relexing
+# ============================================================================
+
+def relex(text, lexemes_list, offset, deleted, inserted):
+    """ `Relexing` of `text` edited.
+
+    `lexemes_list` is the list of the lexemes of `text`, as from
+    `lexemes.raw`. The edit replaces the `deleted` characters at `offset`
+    with the string `inserted`.
+
+    """
+    if offset < 0 or deleted < 0 or offset + deleted > len(text):
+        raise ValueError("Edit out of the text")
+    new_text = text[:offset] + inserted + text[offset + deleted:]
+    delta = len(inserted) - deleted
+    edit_end = offset + len(inserted)  # In the new text.
+    start = restart_index(lexemes_list, offset)
+    in_feffs = in_feffs_before(lexemes_list, start)
+    source = lexemes.Input(new_text)
+    if start > 0:
+        source.pos = lexemes_list[start][1]
+    new_lexemes = []
+    stop = len(lexemes_list)
+    old_index = start
+    old_in_feffs = in_feffs
+    previous_kind = None
+    for lexeme in lexemes_compiled.raw(source, in_feffs, start == 0):
+        pos = lexeme[1]
+        if previous_kind != Fin.T_SPACE and pos >= edit_end and new_lexemes:
+            while (old_index < len(lexemes_list) and
+                   lexemes_list[old_index][1] + delta < pos):
+                kind = lexemes_list[old_index][0]
+                if old_in_feffs:
+                    old_in_feffs = kind != Fin.T_GT_OR_IDENT
+                else:
+                    old_in_feffs = kind in IN_FEFFS_STARTS
+                old_index += 1
+            if (0 < old_index < len(lexemes_list) and
+                    lexemes_list[old_index][1] + delta == pos and
+                    is_iteration_start(lexemes_list, old_index) and
+                    old_in_feffs == in_feffs):
+                stop = old_index
+                break
+        new_lexemes.append(lexeme)
+        kind = lexeme[0]
+        if in_feffs:
+            in_feffs = kind != Fin.T_GT_OR_IDENT
+        else:
+            in_feffs = kind in IN_FEFFS_STARTS
+        previous_kind = kind
+    result_lexemes = lexemes_list[:start]
+    result_lexemes.extend(new_lexemes)
+    result_lexemes.extend(
+        moved(lexeme, delta)
+        for lexeme in lexemes_list[stop:])
+    result = Relexing(
+        new_text,
+        result_lexemes,
+        start,
+        stop,
+        len(new_lexemes))
+    return result
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Lexical check of ATS files, before any `patsopt` invocation.
+
+Files are lexed by `lexemes_compiled.raw`, in a pool of worker processes.
+The location of each lexical error is printed, followed by statistics: the
+number of lexemes of each kind and the throughput.
+
+"""
+
+import collections
+import os
+import sys
+import time
+
+from . import cache
+from . import jsonized
+from . import lexemes
+from . import lexemes_compiled
+from . import lexemes_defs as d
+from . import locations
+
+from .lexemes_defs import Fin
+
+# Constants
+# ============================================================================
+
+HELP = """\
+Usage: %s [-h|--help] [--jobs N] path...
+
+ * -h/--help: display this help.
+ * --jobs N: lex with N worker processes, instead of one per processor.
+ * path...: ATS files, or directories searched recursively for ATS files.
+
+Print the location of each lexical error, then the number of lexemes of
+each kind and the throughput. Exit with status 1 if there are errors.
+
+"""
+
+TEXT_LENGTH = 32  # Length of the text of an erroneous lexeme, when printed.
+
+# `size` is in bytes. `errors` is a list of `(location, kind, text)`.
+# `counts` is a `Counter` of kind names.
+FileResult = collections.namedtuple(
+    "FileResult",
+    ["path", "size", "errors", "counts"])
+
+
+# Helpers
+# ============================================================================
+
+def perror(message):
+    """ Shorthand to print to `stderr`. """
+    print(message, file=sys.stderr)
+
+
+def error(message):
+    """ `perror` and `sys.exit(1)`. """
+    perror(message)
+    sys.exit(1)
+
+
+def is_error(kind, text):
+    """ True if a lexeme of `kind` and `text` is an error for `filtered`.
+    """
+    result = (
+        kind == Fin.T_ERR or
+        kind in d.ERRORS or
+        (kind == Fin.T_IDENT_ext and text not in d.IDENT_EXTS))
+    return result
+
+
+def ats_paths(paths):
+    """ Files of `paths`, with the ATS files of the directories. """
+    result = [path for path in paths if not os.path.isdir(path)]
+    roots = [path for path in paths if os.path.isdir(path)]
+    result.extend(cache.files_from_roots(roots, jsonized.is_ats_file))
+    return result
+
+
+# Lexing
+# ============================================================================
+
+def lexed_file(path):
+    """ `FileResult` of lexing the file at `path`.
+
+    The file is assumed to be readable: an OSError is not handled here.
+
+    """
+    source = lexemes.file_input(path)
+    text = source.source
+    errors = []
+    counts = collections.Counter()
+    line = 1
+    line_start = 0
+    line_pos = 0
+    for (kind, pos, end, lexeme_text) in lexemes_compiled.raw(source):
+        counts[kind.name] += 1
+        if is_error(kind, lexeme_text):
+            line += text.count(d.EOL, line_pos, pos)
+            line_pos = pos
+            line_start = text.rfind(d.EOL, 0, pos) + 1
+            start = locations.Position(pos, line, pos - line_start)
+            end_line = line + text.count(d.EOL, pos, end)
+            end_start = text.rfind(d.EOL, 0, end) + 1
+            end = locations.Position(end, end_line, end - end_start)
+            location = locations.Location(path, start, end)
+            errors.append((location, kind.name, lexeme_text[:TEXT_LENGTH]))
+    result = FileResult(path, os.path.getsize(path), errors, counts)
+    return result
+
+
+def lexed_files(paths, jobs):
+    """ Yield `lexed_file` for each of `paths`, with `jobs` processes. """
+    if jobs == 1:
+        for path in paths:
+            yield lexed_file(path)
+    else:
+        # Only here, for the startup time.
+        import concurrent.futures  # pylint: disable=import-outside-toplevel
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            chunk_size = max(1, len(paths) // (4 * jobs))
+            yield from executor.map(lexed_file, paths, chunksize=chunk_size)
+
+
+def print_results(results, seconds):
+    """ Print the statistics of `results`, lexed in `seconds`. """
+    size = sum(result.size for result in results)
+    counts = collections.Counter()
+    for result in results:
+        counts.update(result.counts)
+    error_count = sum(len(result.errors) for result in results)
+    print("%i files, %i bytes, %i lexemes, %i errors" % (
+        len(results),
+        size,
+        sum(counts.values()),
+        error_count))
+    print("%.2f s, %.2f MB/s" % (seconds, size / max(seconds, 1e-9) / 1e6))
+    for (name, count) in counts.most_common():
+        print("   %-24s %10i" % (name, count))
+
+
+def lex(paths, jobs):
+    """ Lex `paths`, print the errors and statistics, return the errors
+    count. """
+    for path in paths:
+        if not os.access(path, os.R_OK):
+            error("Can't read %s" % path)
+    start = time.perf_counter()
+    results = []
+    for result in lexed_files(paths, jobs):
+        for (location, kind_name, text) in result.errors:
+            print("%s: %s: %r" % (
+                locations.ide_formated(location),
+                kind_name,
+                text))
+        results.append(result)
+    seconds = time.perf_counter() - start
+    print_results(results, seconds)
+    result = sum(len(result.errors) for result in results)
+    return result
+
+
+# Main
+# ============================================================================
+
+def main():
+    """ Invoked by `../pats-lex`. """
+    my_name = os.path.split(sys.argv[0])[1]
+    args = sys.argv[1:]
+
+    if args in [["-h"], ["--help"]]:
+        print(HELP % my_name)
+        sys.exit(0)
+
+    jobs = os.cpu_count() or 1
+    if args[:1] == ["--jobs"]:
+        try:
+            jobs = int(args[1])
+        except (IndexError, ValueError):
+            jobs = 0
+        args = args[2:]
+    if jobs < 1 or not args or any(arg.startswith("-") for arg in args):
+        print("ERROR: Invalid argument(s).", file=sys.stderr)
+        print(HELP % my_name, file=sys.stderr)
+        sys.exit(1)
+
+    if lex(ats_paths(args), jobs):
+        sys.exit(1)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Listing of source file declarations. """
+
+import heapq
+import os
+import sys
+
+from . import declarations
+from . import environment
+from . import images
+from . import locations
+
+
+def perror(message):
+    """ Shorthand to print to `stderr`. """
+    print(message, file=sys.stderr)
+
+
+def error(message):
+    """ `perror` and `sys.exit(1)`. """
+    perror(message)
+    sys.exit(1)
+
+
+def print_loc(loc):
+    """ Shorthand to parse and print formated loc. """
+    loc = locations.parse(loc)
+    loc = locations.ide_formated(loc)
+    print(loc)
+
+
+HR1 = "========================="
+HR2 = "-------------------------"
+
+LABEL1 = "      Name: %s"
+LABEL2 = "      Sort: %s"
+LABEL3 = "      Type: %s"
+LABEL4 = " Sorts are: %s"
+LABEL5 = " Construct: %s"
+
+
+def dump(path, collected):
+    """ Dump declarations `collected` from `path`. """
+    print(HR1)
+    print(os.path.relpath(path))
+    print(HR2)
+    first = True
+    defs = collected.defs
+    if collected.base_sorts:
+        print("Base sorts defined or used:")
+        for name in sorted(collected.base_sorts):
+            print("   " + name)
+            first = False
+    if collected.static_constants:
+        if not first:
+            print(HR2)
+        print("Static constants defined or used:")
+        for name in sorted(collected.static_constants.keys()):
+            sort = collected.static_constants[name]
+            print("   " + name + ": " + images.sort_image(sort))
+            first = False
+    for value in collected.declarations:
+        if not first:
+            print(HR2)
+        first = False
+        print_loc(value.loc)
+        print(LABEL1 % value.name)
+        if value.sort:
+            print(LABEL2 % images.sort_image(value.sort))
+        if value.type:
+            print(LABEL3 % images.type_image(defs, value.type))
+            print(LABEL4 % images.type_sorts_image(defs, value.type))
+        print(LABEL5 % (" ".join(value.construct)))
+
+
+def worker_declarations(path, env):
+    """ `declarations.handle_source_file` in a worker process, or None.
+
+    The `SystemExit` from `declarations.error`, after printing its message,
+    is caught, so that the main process reports the file which failed,
+    instead of the worker process exiting.
+
+    """
+    result = None
+    try:
+        result = declarations.handle_source_file(path, env)
+    except SystemExit:
+        pass
+    return result
+
+
+def recursive_declarations(path, env, jobs):
+    """ Yield `(path, collected)` for `path` and the files it staloads,
+    recursively.
+
+    Files are yielded by order of path, the first of the ones not already
+    yielded and staloaded by the ones yielded first. With `jobs` more than
+    1, files are handled ahead by `jobs` worker processes, as soon as they
+    are known to be staloaded; the order is the same.
+
+    """
+    executor = None
+    if jobs > 1:
+        # Only here, for the startup time.
+        import concurrent.futures  # pylint: disable=import-outside-toplevel
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+    futures = {}  # Path -> future `FileDeclarations`, with `executor`.
+    frontier = []  # Heap of the paths to be yielded.
+    seen = set()
+
+    def push(path):
+        """ Add `path` to `frontier` and submit it to `executor`. """
+        seen.add(path)
+        heapq.heappush(frontier, path)
+        if executor is not None:
+            futures[path] = executor.submit(worker_declarations, path, env)
+
+    try:
+        push(path)
+        while frontier:
+            path = heapq.heappop(frontier)
+            if executor is None:
+                collected = declarations.handle_source_file(path, env)
+            else:
+                collected = futures.pop(path).result()
+                if collected is None:
+                    declarations.error("Failed to list %s" % path)
+            for staloaded in sorted(collected.staloaded.difference(seen)):
+                push(staloaded)
+            yield (path, collected)
+    finally:
+        if executor is not None:
+            for future in futures.values():
+                future.cancel()
+            executor.shutdown()
+
+
+def main():
+    """ Invoked by `../pats-ls`. """
+    env = environment.setup()
+    my_name = os.path.split(sys.argv[0])[1]
+
+    recursive = False
+    jobs = os.cpu_count() or 1
+    if len(sys.argv) >= 2 and sys.argv[1] == "-r":
+        recursive = True
+        del sys.argv[1]
+        # For the many staloads. The staloaded files are not expected to
+        # change during the run, so listings up to `environment.INDEX_TTL`
+        # old are fine.
+        environment.use_directory_index(env)
+        if len(sys.argv) >= 3 and sys.argv[1] == "--jobs":
+            try:
+                jobs = int(sys.argv[2])
+            except ValueError:
+                jobs = 0
+            del sys.argv[1:3]
+
+    if len(sys.argv) != 2 or jobs < 1:
+        error("Usage: %s [-r [--jobs N]] file-name." % my_name)
+
+    path = sys.argv[1]
+    if recursive:
+        for (path, collected) in recursive_declarations(path, env, jobs):
+            dump(path, collected)
+    else:
+        collected = declarations.handle_source_file(path, env)
+        dump(path, collected)
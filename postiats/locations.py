@@ -3,7 +3,9 @@
 
 """ PostiATS text ranges/locations. """
 
+import functools
 import os
+import re
 import urllib
 
 from collections import namedtuple
@@ -48,30 +50,24 @@ END_OF_END = ")"
 #  * "55"           End offset (column)
 #  * ")"            END_OF_END
 #
-# Tested and applied in this order (there are duplicates):
-#
-#  * END_OF_PATH
-#  * LINE_TAG
-#  * OFFS_TAG
-#  * END_OF_START
-#  * LINE_TAG
-#  * OFFS_TAG
-#  * END_OF_END
-
-
-# Helper
-# ----------------------------------------------------------------------------
+# This is matched in a single pass by `LOCATION`, which captures the path
+# and the six numbers.
 
-def find_tag(text, tag, start):
-    """ Tuple `(start, end)` of `tag` in `text` starting at `start`.
+NUMBER = "(-?[0-9]+)"
 
-    If `tag` is not found, `(-1, end)` is returned.
+LOCATION = re.compile(
+    "(.*?)" + re.escape(END_OF_PATH) +
+    NUMBER + re.escape(LINE_TAG) +
+    NUMBER + re.escape(OFFS_TAG) +
+    NUMBER + re.escape(END_OF_BEGIN) +
+    NUMBER + re.escape(LINE_TAG) +
+    NUMBER + re.escape(OFFS_TAG) +
+    NUMBER + re.escape(END_OF_END),
+    re.DOTALL)
 
-    """
-    i = text.find(tag, start)
-    j = i + len(tag)
-    result = (i, j)
-    return result
+# JSON data repeats the same locations many times, so `parse` results are
+# memoized, for at most `PARSE_CACHE_ENTRIES` texts.
+PARSE_CACHE_ENTRIES = 4096
 
 
 # Testing and Parsing
@@ -79,67 +75,36 @@ def find_tag(text, tag, start):
 
 def is_location(text):
     """ True if text is a text range/location. """
-    j = 0
-
-    def test_tag(tag):
-        """ Update (i,j) if i is not -1. """
-        nonlocal j
-        (i, j) = find_tag(text, tag, j)
-        result = i != -1
-        return result
-
-    result = (
-        test_tag(END_OF_PATH) and
-        test_tag(LINE_TAG) and
-        test_tag(OFFS_TAG) and
-        test_tag(END_OF_BEGIN) and
-        test_tag(LINE_TAG) and
-        test_tag(OFFS_TAG) and
-        test_tag(END_OF_END))
-
-    result = result and j == len(text)
-
+    result = LOCATION.fullmatch(text) is not None
     return result
 
 
+@functools.lru_cache(maxsize=PARSE_CACHE_ENTRIES)
 def parse(text):
-    """ Parse `text` as a `Location`. """
-    assert is_location(text)
-
-    i = 0
-    j = 0
-    k = 0
+    """ Parse `text` as a `Location`.
 
-    (j, k) = find_tag(text, END_OF_PATH, k)
-    path = text[i:j]
-    i = k
+    The result is shared by the invocations with the same `text`.
 
-    (j, k) = find_tag(text, LINE_TAG, k)
-    start_byte = int(text[i:j])
-    i = k
-
-    (j, k) = find_tag(text, OFFS_TAG, k)
-    start_line = int(text[i:j])
-    i = k
-
-    (j, k) = find_tag(text, END_OF_BEGIN, k)
-    start_offs = int(text[i:j])
-    i = k
-
-    (j, k) = find_tag(text, LINE_TAG, k)
-    end_byte = int(text[i:j])
-    i = k
-
-    (j, k) = find_tag(text, OFFS_TAG, k)
-    end_line = int(text[i:j])
-    i = k
-
-    (j, k) = find_tag(text, END_OF_END, k)
-    end_offs = int(text[i:j])
-    i = k
-
-    start = Position(char=start_byte, line=start_line, column=start_offs)
-    end = Position(char=end_byte, line=end_line, column=end_offs)
+    """
+    match = LOCATION.fullmatch(text)
+    assert match is not None
+
+    (path,
+     start_byte,
+     start_line,
+     start_offs,
+     end_byte,
+     end_line,
+     end_offs) = match.groups()
+
+    start = Position(
+        char=int(start_byte),
+        line=int(start_line),
+        column=int(start_offs))
+    end = Position(
+        char=int(end_byte),
+        line=int(end_line),
+        column=int(end_offs))
     result = Location(path=path, start=start, end=end)
 
     return result
@@ -8,9 +8,21 @@ of nested span from outer to innest span including the text position.
 The stack of nested spans gives location in the corresponding file with
 a readable name for the ATS2 constructs corresponding to the spans.
 
+The spans of a file are indexed once for each version of its JSON data, in
+a `SpanIndex`, so that a query does not walk the JSON data again, and only
+does a binary search among the spans of each nesting level. The index is
+saved in the cache, next to the JSON data, and is mapped in memory instead
+of loading the JSON data, as long as this one is fresh.
+
 """
 
+import array
+import collections
+import mmap
+import struct
+
 from . import declarations
+from . import environment
 from . import jsonized
 from . import locations
 from . import tags as t
@@ -508,6 +520,386 @@ assert all(k in LABELS for k in LOCS_NODES)
 assert all(k in LABELS for k in LEAFS)
 
 
+# Span index
+# ============================================================================
+
+# Spans are indexed in level order, starting with a root span, the parent of
+# the top-level declarations, which has no location. The children of a span
+# are contiguous, so the first including a position is found by a binary
+# search when they are in order and don't overlap, which is the usual case,
+# and by a linear search otherwise.
+
+SPAN_INDEXES_ENTRIES = 16  # Maximum number of `SPAN_INDEXES` entries.
+
+# path -> (stamp, dependencies, SpanIndex), by recent use. The stamp is that
+# of the cache entry the index is from, see `jsonized.memory_stamp`.
+SPAN_INDEXES = collections.OrderedDict()
+
+ROOT_LOCATION = locations.Location(
+    path="",
+    start=locations.Position(char=0, line=0, column=0),
+    end=locations.Position(char=0, line=0, column=0))
+
+
+class SpanIndex:
+
+    """ Spans of a file, as parallel arrays, a span being an index.
+
+    The arrays are `array.array`, built by `span_index` or copied from a
+    file mapped in memory by `read_span_index`.
+
+    The location of a span is given by `path_ids`, indexes in `paths`, and
+    by its start and end chars, lines and columns; its construct is given
+    by `key_ids`, indexes in `keys`. Its children are the `children_counts`
+    spans from `first_children`, and `ordered` is 1 if they are in order
+    without overlapping.
+
+    """
+
+    __slots__ = [
+        "paths",
+        "keys",
+        "path_ids",
+        "start_chars",
+        "start_lines",
+        "start_columns",
+        "end_chars",
+        "end_lines",
+        "end_columns",
+        "key_ids",
+        "depths",
+        "first_children",
+        "children_counts",
+        "ordered"]
+
+    def __init__(self):
+        self.paths = []
+        self.keys = []
+        self.path_ids = array.array("i")
+        self.start_chars = array.array("i")
+        self.start_lines = array.array("i")
+        self.start_columns = array.array("i")
+        self.end_chars = array.array("i")
+        self.end_lines = array.array("i")
+        self.end_columns = array.array("i")
+        self.key_ids = array.array("i")
+        self.depths = array.array("i")
+        self.first_children = array.array("i")
+        self.children_counts = array.array("i")
+        self.ordered = array.array("B")
+
+    def __len__(self):
+        return len(self.key_ids)
+
+    def append(self, loc, key, depth, path_ids, key_ids):
+        """ Append a span, without children yet.
+
+        `path_ids` and `key_ids` are the tables of the indexes in `paths`
+        and `keys`, updated for new ones. A missing path, as from
+        `get_merged_locs` without locs, is stored as an empty one.
+
+        """
+        path = loc.path or ""
+        if path not in path_ids:
+            path_ids[path] = len(self.paths)
+            self.paths.append(path)
+        if key not in key_ids:
+            key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        self.path_ids.append(path_ids[path])
+        self.start_chars.append(loc.start.char)
+        self.start_lines.append(loc.start.line)
+        self.start_columns.append(loc.start.column)
+        self.end_chars.append(loc.end.char)
+        self.end_lines.append(loc.end.line)
+        self.end_columns.append(loc.end.column)
+        self.key_ids.append(key_ids[key])
+        self.depths.append(depth)
+        self.first_children.append(0)
+        self.children_counts.append(0)
+        self.ordered.append(1)
+
+    def key(self, span):
+        """ Key of the construct of `span`. """
+        return self.keys[self.key_ids[span]]
+
+    def location(self, span):
+        """ `Location` of `span`. """
+        start = locations.Position(
+            char=self.start_chars[span],
+            line=self.start_lines[span],
+            column=self.start_columns[span])
+        end = locations.Position(
+            char=self.end_chars[span],
+            line=self.end_lines[span],
+            column=self.end_columns[span])
+        result = locations.Location(
+            path=self.paths[self.path_ids[span]],
+            start=start,
+            end=end)
+        return result
+
+    def includes(self, span, line, col):
+        """ If line‑col is in `span`, the same as `in_loc`. """
+        result = (
+            (self.start_lines[span], self.start_columns[span]) <=
+            (line, col) <
+            (self.end_lines[span], self.end_columns[span]))
+        return result
+
+
+def are_ordered(index, first, stop):
+    """ True if spans from `first` to `stop` of `index` are in order and
+    don't overlap. """
+    result = True
+    previous_end = None
+    for span in range(first, stop):
+        start = (index.start_lines[span], index.start_columns[span])
+        end = (index.end_lines[span], index.end_columns[span])
+        if end < start or (previous_end is not None and start < previous_end):
+            result = False
+            break
+        previous_end = end
+    return result
+
+
+def listed_locs_nodes(locs_nodes, node):
+    """ List of `locs_nodes(node)`, or an empty one if `node` is malformed.
+
+    A malformed node, as with a missing key or a loc which can't be parsed,
+    is a span without children, so that it only affects the queries inside
+    it, not the whole index.
+
+    """
+    try:
+        result = list(locs_nodes(node))
+    except (AssertionError, KeyError, IndexError, TypeError, ValueError):
+        result = []
+    return result
+
+
+def span_index(root_node):
+    """ `SpanIndex` of the JSON data `root_node`, with a `d2eclist`. """
+    result = SpanIndex()
+    path_ids = {}
+    key_ids = {}
+    result.append(ROOT_LOCATION, "", 0, path_ids, key_ids)
+    pending = collections.deque()
+    pending.append((0, root_node[t.D2ECLIST], d2eclist_locs_nodes))
+    while pending:
+        (parent, node, locs_nodes) = pending.popleft()
+        depth = result.depths[parent] + 1
+        first = len(result)
+        for (loc, next_node, key) in listed_locs_nodes(locs_nodes, node):
+            if key in LOCS_NODES:
+                pending.append((len(result), next_node, LOCS_NODES[key]))
+            result.append(loc, key, depth, path_ids, key_ids)
+        result.first_children[parent] = first
+        result.children_counts[parent] = len(result) - first
+        result.ordered[parent] = are_ordered(result, first, len(result))
+    return result
+
+
+def including_child(index, span, line, col):
+    """ First child of `span` in `index` including line‑col, or None. """
+    first = index.first_children[span]
+    stop = first + index.children_counts[span]
+    if index.ordered[span]:
+        # Only the last child starting before line‑col may include it.
+        low = first
+        high = stop
+        while low < high:
+            middle = (low + high) // 2
+            start = (index.start_lines[middle], index.start_columns[middle])
+            if start <= (line, col):
+                low = middle + 1
+            else:
+                high = middle
+        first = max(first, low - 1)
+        stop = low
+    result = None
+    for child in range(first, stop):
+        if index.includes(child, line, col):
+            result = child
+            break
+    return result
+
+
+def including_spans(index, line, col):
+    """ Spans of `index` including line‑col, from outer to inner. """
+    result = []
+    span = including_child(index, 0, line, col)
+    while span is not None:
+        result.append(span)
+        span = including_child(index, span, line, col)
+    return result
+
+
+# Span index files
+# ----------------------------------------------------------------------------
+
+# A span index file is a header, the paths and keys, separated with NUL
+# characters and padded to a multiple of 4 bytes, then the arrays of the
+# index, in native byte order, `SPANS_INT_ARRAYS` then `ordered`. The header
+# records the stat key of the cache data file the index is from, so that
+# the index is outdated as soon as the data file is written again. An index
+# file in another byte order or of another version is outdated too.
+
+SPANS_MAGIC = b"PATSSPN1"
+SPANS_MARKER = 0x01020304  # To tell the byte order.
+
+# Magic, marker, spans, paths and keys counts, strings size, stat key.
+SPANS_HEADER = struct.Struct("=8siiiiiqqq4x")
+
+SPANS_INT_ARRAYS = [
+    "path_ids",
+    "start_chars",
+    "start_lines",
+    "start_columns",
+    "end_chars",
+    "end_lines",
+    "end_columns",
+    "key_ids",
+    "depths",
+    "first_children",
+    "children_counts"]
+
+
+def spans_strings(index):
+    """ Bytes of the paths and keys of `index`, padded. """
+    strings = index.paths + index.keys
+    result = "\0".join(strings).encode("utf-8", "surrogateescape")
+    result += b"\0" * (-len(result) % 4)
+    return result
+
+
+def write_span_index(file_name, index, data_key):
+    """ Write `index` to `file_name`, for the data file of `data_key`. """
+    strings = spans_strings(index)
+    header = SPANS_HEADER.pack(
+        SPANS_MAGIC,
+        SPANS_MARKER,
+        len(index),
+        len(index.paths),
+        len(index.keys),
+        len(strings),
+        *data_key)
+    parts = [header, strings]
+    for name in SPANS_INT_ARRAYS:
+        parts.append(getattr(index, name).tobytes())
+    parts.append(index.ordered.tobytes())
+    jsonized.write_cache_file(file_name, b"".join(parts))
+
+
+def read_span_index(file_name, data_key):
+    """ `SpanIndex` read from `file_name`, or None if it's missing or not
+    for the data file of `data_key`.
+
+    The file is mapped in memory, and unmapped once the arrays of the index
+    are copied from it.
+
+    """
+    try:
+        with open(file_name, "rb") as source:
+            with mmap.mmap(
+                    source.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    result = mapped_span_index(view, data_key)
+    except (OSError, ValueError):
+        # OSError includes IOError. ValueError is for an empty file.
+        return None
+    return result
+
+
+def mapped_span_index(view, data_key):
+    """ `SpanIndex` copied from `view`, as by `read_span_index`, or None.
+    """
+    if len(view) < SPANS_HEADER.size:
+        return None
+    fields = SPANS_HEADER.unpack_from(view)
+    (magic, marker, count, paths_count, keys_count, strings_size) = fields[:6]
+    size = (
+        SPANS_HEADER.size +
+        strings_size +
+        count * (4 * len(SPANS_INT_ARRAYS) + 1))
+    if (magic != SPANS_MAGIC or
+            marker != SPANS_MARKER or
+            list(fields[6:]) != data_key or
+            len(view) != size):
+        return None
+    result = SpanIndex()
+    offset = SPANS_HEADER.size
+    strings = bytes(view[offset:offset + strings_size]).rstrip(b"\0")
+    strings = strings.decode("utf-8", "surrogateescape").split("\0")
+    result.paths = strings[:paths_count]
+    result.keys = strings[paths_count:paths_count + keys_count]
+    offset += strings_size
+    for name in SPANS_INT_ARRAYS:
+        getattr(result, name).frombytes(view[offset:offset + 4 * count])
+        offset += 4 * count
+    result.ordered.frombytes(view[offset:offset + count])
+    return result
+
+
+def file_span_index(file_name, env=None):
+    """ `SpanIndex` of the source file `file_name`.
+
+    The file name is that of an ATS source file, as the compiler would
+    expect it in `env`, defaulting to the current environment.
+
+    The index is kept in memory and in the cache, as long as the cache
+    entry of the JSON data is the same. If the JSON data has to be loaded,
+    the index is built again and saved.
+
+    """
+    path = environment.which(file_name, env)
+    if path is None:
+        declarations.error("Failed to evaluate %s" % file_name)
+    path = jsonized.clean_path(path)
+    cached_file_name = jsonized.get_cached_file_name(path)
+    data_file_name = jsonized.get_data_file_name(cached_file_name)
+    spans_file_name = jsonized.get_spans_file_name(cached_file_name)
+    entry = SPAN_INDEXES.get(path)
+    if entry is not None:
+        (stamp, dependencies, result) = entry
+        if jsonized.memory_stamp(path, data_file_name, dependencies) == stamp:
+            SPAN_INDEXES.move_to_end(path)
+            return result
+    result = None
+    meta = jsonized.read_meta(path)
+    dependencies = jsonized.memory_dependencies(path, meta)
+    stamp = jsonized.memory_stamp(path, data_file_name, dependencies)
+    keys = dict(zip(dependencies, stamp[2:]))
+    # The stamp is taken before the freshness check, as by `jsonized`.
+    if (stamp[1] is not None and
+            jsonized.is_fresh(path, data_file_name, meta, keys)):
+        result = read_span_index(spans_file_name, stamp[1])
+    if result is None:
+        root_node = jsonized.get_json(path, [t.D2ECLIST], env)
+        if root_node is None:
+            declarations.error("Failed to evaluate %s" % file_name)
+        result = span_index(root_node)
+        meta = jsonized.read_meta(path)
+        dependencies = jsonized.memory_dependencies(path, meta)
+        stamp = jsonized.memory_stamp(path, data_file_name, dependencies)
+        if stamp[1] is not None:
+            try:
+                write_span_index(spans_file_name, result, stamp[1])
+            except OSError:
+                # Includes IOError
+                pass
+    if meta is None or meta.get("unresolved"):
+        # Never fresh, see `jsonized.dependencies_fresh`.
+        return result
+    SPAN_INDEXES[path] = (stamp, dependencies, result)
+    SPAN_INDEXES.move_to_end(path)
+    while len(SPAN_INDEXES) > SPAN_INDEXES_ENTRIES:
+        SPAN_INDEXES.popitem(last=False)
+    return result
+
+
 # Main
 # ============================================================================
 
@@ -519,33 +911,20 @@ def append(result, loc, key):
         result.insert(0, text)
 
 
-def main(path, line, col):
-    """ Main. """
-
+def index_spans_texts(index, line, col):
+    """ Texts of the spans of `index` including line‑col, from inner to
+    outer. """
     result = []
+    for span in including_spans(index, line, col):
+        key = index.key(span)
+        append(result, index.location(span), key)
+        if key not in LOCS_NODES and key not in LEAFS:
+            result.insert(0, "** Unsupported %s **" % key)
+    return result
 
-    root_node = jsonized.get_json(path)
-    if root_node is None:
-        declarations.error("Failed to evaluate %s" % path)
-    node = root_node["d2eclist"]
-    locs_nodes = d2eclist_locs_nodes
-    found = True
-    while found and locs_nodes:
-        found = False
-        for (loc, next_node, key) in locs_nodes(node):
-            if in_loc(line, col, loc):
-                found = True
-                node = next_node
-                append(result, loc, key)
-                if key in LOCS_NODES:
-                    locs_nodes = LOCS_NODES[key]
-                elif key in LEAFS:
-                    locs_nodes = None
-                else:
-                    result.insert(0, "** Unsupported %s **" % key)
-                    locs_nodes = None
-                break
-        if not found:
-            pass
 
+def main(path, line, col):
+    """ Main. """
+    index = file_span_index(path)
+    result = index_spans_texts(index, line, col)
     return result
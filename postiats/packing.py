@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Packed format of the cache entries of `jsonized`.
+
+A packed cache entry is a ZIP archive with one compressed JSON member per
+top-level section of the JSON object, so that a section can be loaded
+without loading the others. See `jsonized.PACKED`.
+
+"""
+
+import io
+import json
+
+# `zipfile` is imported by the functions using it, as `jsonized` does, to
+# keep the startup short when the cache entries are not packed.
+
+# Constants
+# ============================================================================
+
+MEMBER_EXT = ".json"  # Extension of the member of a section.
+
+
+# Packing and unpacking
+# ============================================================================
+
+def packed(json_object):
+    """ Packed `json_object`, as the bytes of a ZIP archive.
+
+    Each top-level section `key` of `json_object` is stored as a compressed
+    member named `key.json`, in the order of `json_object`.
+
+    """
+    import zipfile  # pylint: disable=import-outside-toplevel
+    buffer = io.BytesIO()
+    archive = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED)
+    for (key, value) in json_object.items():
+        text = json.dumps(value, separators=(",", ":"))
+        archive.writestr(key + MEMBER_EXT, text)
+    archive.close()
+    return buffer.getvalue()
+
+
+def unpacked(file_name, sections=None):
+    """ JSON object from packed `file_name`, or None.
+
+    If `sections` is not None, only these top-level sections are loaded,
+    the others are left out of the result.
+
+    """
+    import zipfile  # pylint: disable=import-outside-toplevel
+    result = None
+    try:
+        archive = zipfile.ZipFile(file_name, "r")
+        try:
+            result = {}
+            for member in archive.namelist():
+                key = member[:-len(MEMBER_EXT)]
+                if sections is None or key in sections:
+                    result[key] = json.loads(archive.read(member))
+        except ValueError:
+            result = None
+        archive.close()
+    except (OSError, zipfile.BadZipFile):
+        # OSError includes IOError
+        pass
+    return result
+
+
+def unpacked_size(file_name, sections=None):
+    """ Size of the JSON text of `sections` of packed `file_name`.
+
+    All sections are counted if `sections` is None. The size is zero if the
+    file can't be read.
+
+    """
+    import zipfile  # pylint: disable=import-outside-toplevel
+    result = 0
+    try:
+        archive = zipfile.ZipFile(file_name, "r")
+        for info in archive.infolist():
+            key = info.filename[:-len(MEMBER_EXT)]
+            if sections is None or key in sections:
+                result += info.file_size
+        archive.close()
+    except (OSError, zipfile.BadZipFile):
+        # OSError includes IOError
+        pass
+    return result
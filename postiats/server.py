@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Server doing invocations of `pats-ls`, `pats-whatis` and
+`pats-jsonized --to-stdout` forwarded by `client`.
+
+The server is a long-running process listening on a Unix socket. It keeps
+the modules loaded and the JSON data retrieved in memory (see
+`jsonized.MEMORY`), so that repeated queries on the same files, as from an
+editor, are answered without parsing JSON again.
+
+Requests are served one at a time, in the directory and with the arguments
+of the client. A request from a client with another `PATSHOME`,
+`PATSCONTRIB` or cache location is refused, and the client then does the
+invocation itself.
+
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import traceback
+
+from . import cache
+from . import client
+from . import listing
+from . import whatis
+
+# Constants
+# ============================================================================
+
+HELP = """\
+Usage: %s [-h|--help|--stop]
+
+ * -h/--help: display this help.
+ * --stop: stop the running server.
+
+Without argument, run the server in the foreground, until stopped. The socket
+path is that of the `POSTIATS_SOCKET` environment variable if set.
+
+"""
+
+COMMANDS = {
+    "jsonized": cache.main,
+    "ls": listing.main,
+    "whatis": whatis.main}
+
+STOP = "stop"  # Command to stop the server.
+
+RUNNING = False
+
+
+# Helpers
+# ============================================================================
+
+def perror(message):
+    """ Shorthand to print to `stderr`. """
+    print(message, file=sys.stderr)
+
+
+def error(message):
+    """ `perror` and `sys.exit(1)`. """
+    perror(message)
+    sys.exit(1)
+
+
+# Serving
+# ============================================================================
+
+def is_servable(message):
+    """ True if the request `message` can be served. """
+    result = False
+    command = message.get("command")
+    argv = message.get("argv")
+    if command in COMMANDS and isinstance(argv, list):
+        result = message.get("environment") == client.environment_values()
+        if command == "jsonized":
+            result = result and argv[1:2] == ["--to-stdout"]
+        if command == "whatis" and argv[1:2] == ["--batch"]:
+            result = result and len(argv) == 4  # Not from `stdin`.
+        if command == "ls" and argv[1:2] == ["-r"]:
+            # Not with worker processes, which would block the other clients
+            # and print their errors out of the reply.
+            result = result and argv[2:4] == ["--jobs", "1"]
+    return result
+
+
+def exit_status(code):
+    """ Process status for the `SystemExit` `code`. """
+    if code is None:
+        result = 0
+    elif isinstance(code, int):
+        result = code
+    else:
+        perror(code)
+        result = 1
+    return result
+
+
+def invoke(command, argv, cwd):
+    """ Invoke `command` with `argv` in `cwd`, return its reply.
+
+    Output to `stdout` and `stderr` is captured in the reply.
+
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = 0
+    saved_cwd = os.getcwd()
+    saved_argv = sys.argv
+    with contextlib.redirect_stdout(stdout):
+        with contextlib.redirect_stderr(stderr):
+            try:
+                os.chdir(cwd)
+                sys.argv = list(argv)
+                COMMANDS[command]()
+            except SystemExit as exit_exception:
+                status = exit_status(exit_exception.code)
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+                status = 1
+            finally:
+                os.chdir(saved_cwd)
+                sys.argv = saved_argv
+    result = {
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "status": status}
+    return result
+
+
+def reply_to(message):
+    """ Reply to the request `message`. """
+    global RUNNING
+    if message.get("command") == STOP:
+        RUNNING = False
+        result = {"stdout": "", "stderr": "", "status": 0}
+    elif is_servable(message):
+        result = invoke(message["command"], message["argv"], message["cwd"])
+    else:
+        result = {"refused": True}
+    return result
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    """ Handler of a request from `client`. """
+
+    def handle(self):
+        data = self.rfile.read()
+        if not data:
+            return  # Only checked by `is_running`.
+        try:
+            message = json.loads(data.decode("utf-8"))
+        except ValueError:
+            message = {}
+        if not isinstance(message, dict):
+            message = {}
+        reply = reply_to(message)
+        try:
+            self.wfile.write(json.dumps(reply).encode("utf-8"))
+        except OSError:
+            pass  # The client is gone.
+
+
+# Running and stopping
+# ============================================================================
+
+def is_running(path):
+    """ True if a server is listening on `path`. """
+    result = False
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(client.CONNECT_TIMEOUT)
+        connection.connect(path)
+        result = True
+    except OSError:
+        pass
+    connection.close()
+    return result
+
+
+def run():
+    """ Serve requests until stopped. """
+    global RUNNING
+    path = client.socket_path()
+    if is_running(path):
+        error("A server is already running on %s" % path)
+    if os.path.exists(path):
+        os.remove(path)  # Left by a server which did not stop properly.
+    mask = os.umask(0o077)  # Only the user may connect.
+    try:
+        server = socketserver.UnixStreamServer(path, RequestHandler)
+    finally:
+        os.umask(mask)
+    RUNNING = True
+    try:
+        while RUNNING:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    os.remove(path)
+
+
+def stop():
+    """ Stop the running server. """
+    path = client.socket_path()
+    if not is_running(path):
+        error("No server is running on %s" % path)
+    client.request(STOP, [])
+
+
+# Main
+# ============================================================================
+
+def main():
+    """ Invoked by `../pats-server`. """
+    my_name = os.path.split(sys.argv[0])[1]
+
+    arg_error = True
+
+    if len(sys.argv) == 1:
+        arg_error = False
+        run()
+    if len(sys.argv) == 2:
+        arg1 = sys.argv[1]
+        if arg1 in ["-h", "--help"]:
+            arg_error = False
+            print(HELP % my_name)
+        elif arg1 == "--stop":
+            arg_error = False
+            stop()
+
+    if arg_error:
+        print("ERROR: Invalid argument(s).", file=sys.stderr)
+        print(HELP % my_name, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Filtering of PostiATS output lines by chunks, for `pats-filter --stream`.
+"""
+
+import re
+
+from . import filter as message_filter
+from . import filtering
+from . import locations
+
+# Configuration (editable)
+# ============================================================================
+
+# See `StreamFilter`.
+STREAM_CHUNK = 64 * 1024  # Characters read at once.
+HEAD_LIMIT = 64 * 1024  # Maximum length of a message location and level.
+SPOOL_SIZE = 1024 * 1024  # Size of pretty printed expressions kept in memory.
+
+
+# Streaming
+# ============================================================================
+
+# With `--stream`, input is read by chunks and the output of a line is
+# written while the line is read, which matters with lines of megabytes, as
+# `**SHOWTYPE[UP]**` messages can be. The memory used depends on the size of
+# the largest expression in a line, not on the size of the line. This is not
+# a bound for a single huge expression, as the type of a `**SHOWTYPE[UP]**`
+# message, which is parsed and pretty printed as a whole.
+#
+# The folded text goes to the output as soon as it's known to contain no
+# expression start, while the pretty printed expressions are written to
+# a temporary file, until the end of the line. An expression is parsed only
+# when it's complete in the buffer: since a node parse never goes past the
+# closing parenthesis matching its opening parenthesis, and looks at most
+# two characters ahead, this is known without parsing it.
+#
+# The output is the same as without `--stream`, provided the location and
+# level of a message are in the first `HEAD_LIMIT` characters of its line.
+
+PARENTHESIS = re.compile("[()]")
+
+
+def expression_end(text, start):
+    """ Index up to which parsing a root node at `start` looks, or None.
+
+    None is returned if this index is beyond the end of `text`, that is, if
+    there is not enough text to parse the node, and -1 is returned if no
+    root node can be parsed at `start`.
+
+    """
+    result = None
+    i = start + 2  # After the `parse_d2s2c3_name` prefix.
+    length = len(text)
+    if i < length and not text[i].isalpha():
+        return -1
+    while i < length and text[i].isalpha():
+        i += 1
+    if i < length:
+        if text[i] == "(":
+            depth = 0
+            for match in PARENTHESIS.finditer(text, i):
+                if match.group() == "(":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        i = match.end()
+                        break
+            if depth != 0:
+                return None
+        result = i + 2  # The `get_end_kind` lookahead.
+        if result > length:
+            result = None
+    return result
+
+
+class StreamFilter(object):
+    """ Lines filtering, with the output of a line written while it's read.
+
+    Text is given with `feed` and the end of a line with `end_line`.
+
+    """
+
+    __slots__ = [
+        "output",
+        "buffer",  # Text of the current line not handled yet.
+        "wanted",  # Buffer size before trying again.
+        "head_done",  # True if the message head of the line was handled.
+        "message_before",
+        "fold_count",
+        "targets"]  # Pretty printed expressions of the current line.
+
+    def __init__(self, output):
+        """ Write the output to `output`. """
+        self.output = output
+        self.buffer = ""
+        self.wanted = 0
+        self.head_done = False
+        self.message_before = False  # For managing additional blank lines.
+        self.fold_count = 0
+        import tempfile  # pylint: disable=import-outside-toplevel
+        self.targets = tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode="w+")
+
+    def feed(self, text):
+        """ Handle `text`, which is a part of the current line. """
+        self.buffer += text
+        if len(self.buffer) >= self.wanted:
+            self.handle(False)
+
+    def end_line(self):
+        """ Handle the end of the current line. """
+        import shutil  # pylint: disable=import-outside-toplevel
+        self.handle(True)
+        self.output.write("\n")
+        self.targets.seek(0)
+        shutil.copyfileobj(self.targets, self.output)
+        self.targets.seek(0)
+        self.targets.truncate()
+        self.buffer = ""
+        self.wanted = 0
+        self.head_done = False
+        self.fold_count = 0
+
+    def handle(self, final):
+        """ Write what can be of the buffer, `final` at the end of line. """
+        if not self.head_done:
+            self.buffer = self.buffer.lstrip()
+            if final or len(self.buffer.rstrip()) >= HEAD_LIMIT:
+                self.handle_head(final)
+            else:
+                self.wanted = 2 * len(self.buffer)
+        if self.head_done:
+            self.handle_text(final)
+        self.output.flush()
+
+    def handle_head(self, final):
+        """ Write the location of a message, if the line is a message. """
+        if final:
+            line = self.buffer.rstrip()
+        else:
+            line = self.buffer[:HEAD_LIMIT]
+        prefix = ""  # Added to the line text by the message parsing.
+        if message_filter.is_message_with_location(line):
+            message = message_filter.parse_message_with_location(line)
+        elif message_filter.is_showtype_message(line):
+            message = message_filter.parse_showtype_message(line)
+            prefix = message_filter.SHOWTYPE_TEXT_PREFIX
+        else:
+            message = None
+        if message:
+            text_start = len(line) - len(message.text) + len(prefix)
+            location = locations.ide_formated(
+                message.location,
+                message_filter.LOCATION_WITH_COLUMN)
+            self.output.write("\n")  # Separate messages with blank lines.
+            self.output.write("%s: %s" % (location, prefix))
+            self.buffer = self.buffer[text_start:]
+            self.message_before = True
+        else:
+            if self.message_before:
+                # Separate from messages with blank lines.
+                self.output.write("\n")
+            self.message_before = False
+        self.head_done = True
+
+    def handle_text(self, final):
+        """ Write the folded text, and the expressions to `targets`. """
+        text = self.buffer.rstrip()
+        string = message_filter.String(text)
+        position = 0  # End of the text already written.
+        incomplete = False
+        match = filtering.ROOT_NODE_START.search(text)
+        while match is not None:
+            start = match.start()
+            if final:
+                end = len(text)
+            else:
+                end = expression_end(text, start)
+            if end is None:
+                incomplete = True
+                break
+            tree = None
+            if end != -1:
+                string.index = start
+                tree = message_filter.parse_node(string)
+            if filtering.is_root_node(tree):
+                self.output.write(text[position:start])
+                position = string.index
+                self.fold(tree, text[start:position], string)
+                match = filtering.ROOT_NODE_START.search(text, position)
+            else:
+                match = filtering.ROOT_NODE_START.search(text, start + 1)
+        if incomplete:
+            written = start
+        elif final:
+            written = len(text)
+        else:
+            written = max(position, len(text) - 1)  # May be a prefix start.
+        self.output.write(text[position:written])
+        self.buffer = self.buffer[written:]
+        if incomplete:
+            self.wanted = 2 * len(self.buffer)
+        else:
+            self.wanted = 0
+
+    def fold(self, tree, source, string):
+        """ Write a reference to `tree` and its image to `targets`.
+
+        `source` is the text of `tree`, and `string` is after it.
+
+        """
+        self.fold_count += 1
+        if not string.has_item() or string.item() != "]":
+            self.output.write("[%i]" % self.fold_count)
+        else:
+            self.output.write("%i" % self.fold_count)
+        self.targets.write("[%i]: " % self.fold_count)
+        self.targets.write(filtering.expression_image(tree, source))
+
+
+def stream(source, output):
+    """ Filter `source` to `output`, with a `StreamFilter`. """
+    stream_filter = StreamFilter(output)
+    unterminated = False  # True if the last line has no end of line.
+    chunk = source.read(STREAM_CHUNK)
+    while chunk:
+        lines = chunk.split("\n")
+        for line in lines[:-1]:
+            stream_filter.feed(line)
+            stream_filter.end_line()
+        stream_filter.feed(lines[-1])
+        unterminated = lines[-1] != ""
+        chunk = source.read(STREAM_CHUNK)
+    if unterminated:
+        stream_filter.end_line()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8; mode:python3; indent-tabs-mode:nil; tab-width:4; -*-
+
+""" Nested spans from text position.
+
+From a point defined as a file name, line and column, get the list
+of nested span from outer to innest span including the text position.
+
+The stack of nested spans gives location in the corresponding file with
+a readable name for the ATS2 constructs corresponding to the spans.
+
+The result is displayed on `stdout`, from inner to outest span.
+
+With `--batch`, positions are read as “line column” lines, from a queries
+file or from `stdin`, and the result for each is displayed as a line of
+JSON, as it is read. All are answered from the same `SpanIndex`.
+
+File name is handled the same way as with `pats-which`.
+
+"""
+
+import json
+import os
+import sys
+
+from . import environment
+from . import locations
+from . import nested_spans
+
+USAGE = (
+    "Usage: %s file-name line column\n"
+    "       %s --batch file-name [queries-file]")
+
+
+def perror(message):
+    """ Shorthand to print to `stderr`. """
+    print(message, file=sys.stderr)
+
+
+def error(message):
+    """ `perror` and `sys.exit(1)`. """
+    perror(message)
+    sys.exit(1)
+
+
+def span_object(index, span):
+    """ JSON object for `span` of `index`.
+
+    `construct` is None for an unsupported construct, whose `key` is then
+    to be reported.
+
+    """
+    loc = index.location(span)
+    key = index.key(span)
+    path = loc.path
+    if locations.REL_PATH:
+        path = os.path.relpath(path)
+    result = {
+        "path": path,
+        "line": loc.start.line,
+        "column": loc.start.column,
+        "end_line": loc.end.line,
+        "end_column": loc.end.column,
+        "construct": nested_spans.LABELS.get(key),
+        "key": key}
+    return result
+
+
+def query_object(index, text):
+    """ JSON object answering the query `text`, a “line column” line.
+
+    Spans are from inner to outer, as without `--batch`.
+
+    """
+    try:
+        (line, col) = [int(field) for field in text.split()]
+    except ValueError:
+        return {"error": "Invalid query: %s" % text.strip()}
+    spans = nested_spans.including_spans(index, line, col)
+    result = {
+        "line": line,
+        "column": col,
+        "spans": [span_object(index, span) for span in reversed(spans)]}
+    return result
+
+
+def batch(path, queries):
+    """ Answer each of the `queries` lines on `path`, as JSON lines. """
+    index = nested_spans.file_span_index(path)
+    for text in queries:
+        if text.strip():
+            print(json.dumps(query_object(index, text)), flush=True)
+
+
+def main():
+    """ Invoked by `../pats-whatis`. """
+    environment.setup()
+    my_name = os.path.split(sys.argv[0])[1]
+    if sys.argv[1:2] == ["--batch"] and len(sys.argv) in [3, 4]:
+        path = sys.argv[2]
+        queries = sys.stdin
+        if len(sys.argv) == 4:
+            try:
+                queries = open(sys.argv[3])
+            except OSError as exception:
+                error("Failed to read %s: %s" % (
+                    sys.argv[3],
+                    exception.strerror))
+        with queries:
+            batch(path, queries)
+        return
+    if len(sys.argv) != 4:
+        error(USAGE % (my_name, my_name))
+    path = sys.argv[1]
+    try:
+        line = int(sys.argv[2])
+        col = int(sys.argv[3])
+    except ValueError:
+        error("Line and column must be integer.")
+    result = nested_spans.main(path, line, col)
+    for text_line in result:
+        print(text_line)